@@ -0,0 +1,296 @@
+import math
+import os
+from pathlib import Path
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from analysis.lib.raster import get_block_offsets
+
+
+# histograms are only created for datasets with this internal block size
+BLOCK_SIZE = 256
+
+# number of blocks along each dimension summarized in the coarser pyramid level
+PYRAMID_FACTOR = 8
+
+# number of blocks along a row of blocks to read at a time when creating
+# histograms
+CHUNK_BLOCKS = 8
+
+
+def get_block_histogram_filenames(filename):
+    """Get the filenames of the block histograms and the coarser pyramid level
+    of block histograms for a raster.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    tuple of (Path, Path)
+    """
+    filename = Path(filename)
+    prefix = filename.parent / f"{filename.stem}_block_histograms"
+    return Path(f"{prefix}.npy"), Path(f"{prefix}_{PYRAMID_FACTOR}.npy")
+
+
+def create_block_histograms(filename, num_bins):
+    """Create histograms of the values within each internal block of a
+    categorical raster, and a coarser pyramid level of histograms for groups of
+    PYRAMID_FACTOR x PYRAMID_FACTOR blocks.
+
+    Histograms are stored as arrays of shape (block rows, block cols, bands,
+    bins) in .npy files alongside the raster, so that they can be memory-mapped
+    when reading.  NODATA values and values >= num_bins are not counted.
+
+    Parameters
+    ----------
+    filename : str or Path
+    num_bins : int
+        number of bins (values 0 to num_bins - 1) to count
+    """
+    blocks_filename, groups_filename = get_block_histogram_filenames(filename)
+
+    with rasterio.open(filename) as src:
+        if src.block_shapes[0] != (BLOCK_SIZE, BLOCK_SIZE):
+            raise ValueError(
+                f"{filename} must have internal blocks of {BLOCK_SIZE}x{BLOCK_SIZE}"
+            )
+
+        nodata = src.nodata
+        bands = src.count
+        block_rows = math.ceil(src.height / BLOCK_SIZE)
+        block_cols = math.ceil(src.width / BLOCK_SIZE)
+
+        blocks = np.lib.format.open_memmap(
+            blocks_filename,
+            mode="w+",
+            dtype="uint32",
+            shape=(block_rows, block_cols, bands, num_bins),
+        )
+
+        for block_row in range(block_rows):
+            row_off = block_row * BLOCK_SIZE
+            height = min(BLOCK_SIZE, src.height - row_off)
+
+            for start in range(0, block_cols, CHUNK_BLOCKS):
+                end = min(start + CHUNK_BLOCKS, block_cols)
+                num_blocks = end - start
+                col_off = start * BLOCK_SIZE
+                width = min(num_blocks * BLOCK_SIZE, src.width - col_off)
+
+                data = src.read(window=Window(col_off, row_off, width, height))
+
+                # pad partial blocks with NODATA and reshape to
+                # (blocks, bands, pixels)
+                padded = np.full(
+                    (bands, BLOCK_SIZE, num_blocks * BLOCK_SIZE),
+                    nodata,
+                    dtype=data.dtype,
+                )
+                padded[:, :height, :width] = data
+                values = (
+                    padded.reshape(bands, BLOCK_SIZE, num_blocks, BLOCK_SIZE)
+                    .transpose(2, 0, 1, 3)
+                    .reshape(num_blocks, bands, -1)
+                )
+
+                # count all blocks and bands at once by offsetting values by
+                # block and band
+                offsets = (
+                    np.arange(num_blocks * bands, dtype="int64").reshape(
+                        num_blocks, bands, 1
+                    )
+                    * num_bins
+                )
+                ix = (values != nodata) & (values < num_bins)
+                blocks[block_row, start:end] = np.bincount(
+                    (offsets + values)[ix], minlength=num_blocks * bands * num_bins
+                ).reshape(num_blocks, bands, num_bins)
+
+        blocks.flush()
+
+        # sum histograms for each group of blocks
+        group_rows = math.ceil(block_rows / PYRAMID_FACTOR)
+        group_cols = math.ceil(block_cols / PYRAMID_FACTOR)
+        groups = np.lib.format.open_memmap(
+            groups_filename,
+            mode="w+",
+            dtype="uint32",
+            shape=(group_rows, group_cols, bands, num_bins),
+        )
+        for group_row in range(group_rows):
+            row_blocks = blocks[
+                group_row * PYRAMID_FACTOR : (group_row + 1) * PYRAMID_FACTOR
+            ].sum(axis=0)
+            for group_col in range(group_cols):
+                groups[group_row, group_col] = row_blocks[
+                    group_col * PYRAMID_FACTOR : (group_col + 1) * PYRAMID_FACTOR
+                ].sum(axis=0)
+
+        groups.flush()
+
+
+class BlockHistograms(object):
+    """Precomputed histograms of values within each internal block of a
+    categorical raster, used to count pixels in blocks that are entirely within
+    a geometry mask without reading them.
+    """
+
+    def __init__(self, blocks_filename, groups_filename):
+        """
+        Parameters
+        ----------
+        blocks_filename : Path
+            .npy file of histograms per block
+        groups_filename : Path
+            .npy file of histograms per group of PYRAMID_FACTOR x PYRAMID_FACTOR
+            blocks
+        """
+        self.blocks = np.load(blocks_filename, mmap_mode="r")
+        self.groups = np.load(groups_filename, mmap_mode="r")
+
+    def count_full_blocks(self, window, mask, num_bins):
+        """Count pixels in the blocks that are entirely within window and mask,
+        using the precomputed histograms.
+
+        Parameters
+        ----------
+        window : rasterio.windows.Window
+            must be within the extent of the dataset
+        mask : 2d boolean ndarray
+            True for pixels within geometry; must be same shape as window
+        num_bins : int
+
+        Returns
+        -------
+        tuple of (ndarray of shape (bands, num_bins), 2d boolean ndarray)
+            counts for full blocks, and mask with full blocks set to False so
+            that only the remaining pixels need to be read
+        """
+        counts = np.zeros((self.blocks.shape[2], num_bins), dtype="int64")
+        stored_bins = min(num_bins, self.blocks.shape[3])
+
+        row_off = int(window.row_off)
+        col_off = int(window.col_off)
+        row_starts, row_ends = get_block_offsets(row_off, mask.shape[0], BLOCK_SIZE)
+        col_starts, col_ends = get_block_offsets(col_off, mask.shape[1], BLOCK_SIZE)
+
+        # blocks are full if they are not truncated by the window and all
+        # pixels are within mask
+        full = np.array(
+            [
+                np.logical_and.reduceat(mask[start:end].all(axis=0), col_starts)
+                for start, end in zip(row_starts, row_ends)
+            ]
+        )
+        full &= ((row_ends - row_starts) == BLOCK_SIZE)[:, np.newaxis]
+        full &= ((col_ends - col_starts) == BLOCK_SIZE)[np.newaxis, :]
+
+        if not full.any():
+            return counts, mask
+
+        # absolute index of first block row and col in window
+        first_row = row_off // BLOCK_SIZE
+        first_col = col_off // BLOCK_SIZE
+
+        # use the coarser level for groups of blocks where all blocks are full
+        remaining = full.copy()
+        group_row_start = -(-first_row // PYRAMID_FACTOR)
+        group_row_end = (first_row + full.shape[0]) // PYRAMID_FACTOR
+        group_col_start = -(-first_col // PYRAMID_FACTOR)
+        group_col_end = (first_col + full.shape[1]) // PYRAMID_FACTOR
+
+        if group_row_end > group_row_start and group_col_end > group_col_start:
+            rows = slice(
+                group_row_start * PYRAMID_FACTOR - first_row,
+                group_row_end * PYRAMID_FACTOR - first_row,
+            )
+            cols = slice(
+                group_col_start * PYRAMID_FACTOR - first_col,
+                group_col_end * PYRAMID_FACTOR - first_col,
+            )
+            full_groups = (
+                full[rows, cols]
+                .reshape(
+                    group_row_end - group_row_start,
+                    PYRAMID_FACTOR,
+                    group_col_end - group_col_start,
+                    PYRAMID_FACTOR,
+                )
+                .all(axis=(1, 3))
+            )
+
+            if full_groups.any():
+                group_rows, group_cols = np.nonzero(full_groups)
+                counts[:, :stored_bins] += self.groups[
+                    group_rows + group_row_start, group_cols + group_col_start
+                ].sum(axis=0, dtype="int64")[:, :stored_bins]
+
+                remaining[rows, cols] &= ~np.repeat(
+                    np.repeat(full_groups, PYRAMID_FACTOR, axis=0),
+                    PYRAMID_FACTOR,
+                    axis=1,
+                )
+
+        block_rows, block_cols = np.nonzero(remaining)
+        if len(block_rows):
+            counts[:, :stored_bins] += self.blocks[
+                block_rows + first_row, block_cols + first_col
+            ].sum(axis=0, dtype="int64")[:, :stored_bins]
+
+        # remove full blocks from the mask
+        covered = np.repeat(
+            np.repeat(full, row_ends - row_starts, axis=0),
+            col_ends - col_starts,
+            axis=1,
+        )
+
+        return counts, mask & ~covered
+
+
+# loaded block histograms, keyed by raster filename
+_histograms = {}
+_lock = threading.Lock()
+
+
+def get_block_histograms(filename):
+    """Get block histograms for a raster, if they have been created and are
+    newer than the raster.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    BlockHistograms or None
+    """
+    filename = str(filename)
+    blocks_filename, groups_filename = get_block_histogram_filenames(filename)
+
+    try:
+        raster_mtime = os.stat(filename).st_mtime_ns
+        signature = (
+            raster_mtime,
+            os.stat(blocks_filename).st_mtime_ns,
+            os.stat(groups_filename).st_mtime_ns,
+        )
+    except FileNotFoundError:
+        return None
+
+    # histograms are out of date if raster was modified after they were created
+    if min(signature[1:]) < raster_mtime:
+        return None
+
+    with _lock:
+        prev_signature, histograms = _histograms.get(filename, (None, None))
+        if prev_signature != signature:
+            histograms = BlockHistograms(blocks_filename, groups_filename)
+            _histograms[filename] = (signature, histograms)
+
+    return histograms
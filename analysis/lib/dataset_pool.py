@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+import os
+import threading
+
+from analysis.lib.hot_store import get_hot_store_filenames, open_raster
+
+
+class DatasetPool(object):
+    """Pool of open rasterio datasets keyed by filename, so that long-running
+    processes avoid repeatedly opening and parsing the headers of the same files.
+
+    GDAL dataset handles must not be shared between threads, so each thread
+    gets its own handle for a given filename.  Handles are reopened if the file
+    or its hot store has been modified since it was opened.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # {(filename, thread id): (dataset, (mtime, size))}
+        self.datasets = {}
+
+    def get(self, filename):
+        """Get an open dataset for filename, opening it if necessary.
+
+        Parameters
+        ----------
+        filename : str or Path
+
+        Returns
+        -------
+        open rasterio dataset
+            NOTE: this must not be closed by the caller
+        """
+        filename = str(filename)
+        stat = os.stat(filename)
+        manifest_filename = get_hot_store_filenames(filename)[1]
+        signature = (
+            stat.st_mtime_ns,
+            stat.st_size,
+            os.stat(manifest_filename).st_mtime_ns
+            if manifest_filename.exists()
+            else None,
+        )
+        key = (filename, threading.get_ident())
+
+        with self.lock:
+            # handles inherited by a forked process cannot be reused
+            if os.getpid() != self.pid:
+                self.pid = os.getpid()
+                self.datasets = {}
+
+            dataset, prev_signature = self.datasets.get(key, (None, None))
+            if dataset is not None:
+                if prev_signature == signature and not dataset.closed:
+                    return dataset
+
+                dataset.close()
+
+            dataset = open_raster(filename)
+            self.datasets[key] = (dataset, signature)
+
+            return dataset
+
+    def close(self):
+        """Close all open datasets in the pool."""
+        with self.lock:
+            if os.getpid() == self.pid:
+                for dataset, _ in self.datasets.values():
+                    dataset.close()
+
+            self.datasets = {}
+
+
+# process-wide dataset pool; only used if opened via open_dataset_pool()
+pool = None
+
+
+def open_dataset_pool():
+    """Create the process-wide dataset pool used by open_dataset."""
+    global pool
+
+    if pool is None:
+        pool = DatasetPool()
+
+
+def close_dataset_pool():
+    """Close all datasets in the process-wide dataset pool and stop using it."""
+    global pool
+
+    if pool is not None:
+        pool.close()
+        pool = None
+
+
+@contextmanager
+def open_dataset(filename):
+    """Open a rasterio dataset for reading.
+
+    If the raster has an up to date hot store, it is memory-mapped instead of
+    opened with rasterio.
+
+    If the process-wide dataset pool has been opened, the dataset is retrieved
+    from the pool and left open on exit; otherwise the dataset is opened and
+    closed here.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Yields
+    ------
+    HotStoreDataset or open rasterio dataset
+    """
+    if pool is None:
+        with open_raster(filename) as dataset:
+            yield dataset
+
+    else:
+        yield pool.get(filename)
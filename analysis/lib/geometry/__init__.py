@@ -1,6 +1,7 @@
 # ruff: noqa
 
 from analysis.lib.geometry.aggregate import (
+    cluster_parts,
     dissolve,
     find_contiguous_groups,
     union_or_combine,
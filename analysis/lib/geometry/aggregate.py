@@ -157,3 +157,34 @@ def find_contiguous_groups(geometries):
     )
 
     return groups
+
+
+def cluster_parts(geometry, distance):
+    """Group the parts of a MultiPolygon into clusters of parts that are within
+    distance of each other (directly or via other parts).
+
+    Parameters
+    ----------
+    geometry : shapely Polygon or MultiPolygon
+    distance : float
+        maximum distance between parts in the same cluster
+
+    Returns
+    -------
+    list of shapely geometries
+        one geometry per cluster, containing the parts in that cluster; if
+        there is only one cluster, geometry is returned unmodified
+    """
+    parts = shapely.get_parts(geometry)
+    if len(parts) < 2:
+        return [geometry]
+
+    tree = shapely.STRtree(parts)
+    # includes self pairs, so that isolated parts form their own cluster
+    left, right = tree.query(parts, predicate="dwithin", distance=distance)
+    groups = DirectedGraph.from_arrays(left, right).components()
+
+    if len(groups) == 1:
+        return [geometry]
+
+    return [shapely.multipolygons(parts[sorted(group)]) for group in groups]
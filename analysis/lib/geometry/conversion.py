@@ -61,4 +61,62 @@ def to_dict(geometry):
 
     return {"type": geom_type, "coordinates": coords}
 
-to_dict_all = np.vectorize(to_dict)
+
+def to_dict_all(geometries):
+    """Convert an array of shapely Polygon or MultiPolygon objects to dictionary
+    representations equivalent to the structure of GeoJSON.
+
+    Coordinates for all geometries are extracted in a single vectorized
+    operation and converted to Python lists at once, which is much faster than
+    converting each geometry individually.
+
+    Parameters
+    ----------
+    geometries : ndarray of shapely Geometry objects
+
+    Returns
+    -------
+    ndarray of dicts
+        GeoJSON dict representations of geometries
+    """
+    geometries = shapely.normalize(np.asarray(geometries, dtype="object"))
+    type_ids = shapely.get_type_id(geometries)
+
+    if not np.isin(type_ids, [3, 6]).all():
+        raise NotImplementedError("Not built")
+
+    out = np.empty(len(geometries), dtype="object")
+    if len(geometries) == 0:
+        return out
+
+    # Polygons are promoted to MultiPolygons if there is a mix of both types
+    geom_type, coords, (ring_offsets, part_offsets, *geom_offsets) = (
+        shapely.to_ragged_array(geometries)
+    )
+
+    coords = coords.tolist()
+    rings = [
+        coords[start:end] for start, end in zip(ring_offsets[:-1], ring_offsets[1:])
+    ]
+    parts = [
+        rings[start:end] for start, end in zip(part_offsets[:-1], part_offsets[1:])
+    ]
+
+    if geom_type == shapely.GeometryType.POLYGON:
+        # each part is a single Polygon
+        geom_parts = [[part] for part in parts]
+    else:
+        geom_offsets = geom_offsets[0]
+        geom_parts = [
+            parts[start:end] for start, end in zip(geom_offsets[:-1], geom_offsets[1:])
+        ]
+
+    for i, (type_id, geom) in enumerate(zip(type_ids, geom_parts)):
+        if type_id == 3:
+            # empty Polygons have a single empty ring, same as to_dict
+            coords = geom[0] if geom and geom[0] else [[]]
+            out[i] = {"type": "Polygon", "coordinates": coords}
+        else:
+            out[i] = {"type": "MultiPolygon", "coordinates": geom}
+
+    return out
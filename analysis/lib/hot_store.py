@@ -0,0 +1,224 @@
+import json
+import os
+from pathlib import Path
+
+from affine import Affine
+import numpy as np
+import rasterio
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.windows import Window, bounds, from_bounds, transform
+
+# number of rows read at a time when creating a hot store
+STRIP_HEIGHT = 1024
+
+
+def get_hot_store_filenames(filename):
+    """Get the filenames of the uncompressed array and manifest of the hot store
+    for a raster.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    tuple of (Path, Path)
+    """
+    filename = Path(filename)
+    prefix = filename.parent / f"{filename.stem}_hot"
+    return Path(f"{prefix}.npy"), Path(f"{prefix}.json")
+
+
+def create_hot_store(filename):
+    """Create an uncompressed copy of a raster as a .npy array of shape (bands,
+    height, width) with a JSON manifest of its transform, NODATA value, and
+    other properties, so that it can be memory-mapped and read without
+    decompression.
+
+    The manifest is written last and records the modification time and size of
+    the raster, so that incomplete or out of date hot stores are not used.
+
+    Parameters
+    ----------
+    filename : str or Path
+    """
+    array_filename, manifest_filename = get_hot_store_filenames(filename)
+    manifest_filename.unlink(missing_ok=True)
+
+    stat = os.stat(filename)
+
+    with rasterio.open(filename) as src:
+        data = np.lib.format.open_memmap(
+            array_filename,
+            mode="w+",
+            dtype=src.dtypes[0],
+            shape=(src.count, src.height, src.width),
+        )
+
+        for row_off in range(0, src.height, STRIP_HEIGHT):
+            height = min(STRIP_HEIGHT, src.height - row_off)
+            window = Window(0, row_off, src.width, height)
+            data[:, row_off : row_off + height] = src.read(window=window)
+
+        data.flush()
+        del data
+
+        manifest = {
+            "source": {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size},
+            "width": src.width,
+            "height": src.height,
+            "count": src.count,
+            "dtype": src.dtypes[0],
+            "nodata": src.nodata,
+            "transform": list(src.transform)[:6],
+            "crs": src.crs.to_wkt() if src.crs else None,
+            "block_shape": list(src.block_shapes[0]),
+        }
+
+    with open(manifest_filename, "w") as out:
+        out.write(json.dumps(manifest))
+
+
+class HotStoreDataset(object):
+    """Read-only memory-mapped hot store of a raster that provides the subset of
+    the interface of an open rasterio dataset used when calculating statistics.
+
+    Reads return views of the memory-mapped array rather than copies, so the
+    returned data must not be modified.  The memory-mapped pages are shared
+    between all processes that read the same hot store.
+    """
+
+    def __init__(self, filename, array_filename, manifest):
+        """
+        Parameters
+        ----------
+        filename : str
+            filename of the source raster
+        array_filename : Path
+            .npy file of hot store
+        manifest : dict
+            manifest of hot store
+        """
+        self.name = filename
+        self.data = np.load(array_filename, mmap_mode="r")
+        self.count = manifest["count"]
+        self.width = manifest["width"]
+        self.height = manifest["height"]
+        self.shape = (self.height, self.width)
+        self.dtypes = (manifest["dtype"],) * self.count
+        self.nodata = manifest["nodata"]
+        self.nodatavals = (self.nodata,) * self.count
+        self.transform = Affine(*manifest["transform"])
+        self.res = (abs(self.transform.a), abs(self.transform.e))
+        self.bounds = BoundingBox(
+            *bounds(Window(0, 0, self.width, self.height), self.transform)
+        )
+        self.crs = CRS.from_wkt(manifest["crs"]) if manifest["crs"] else None
+        self.block_shapes = [tuple(manifest["block_shape"])] * self.count
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.data = None
+        self.closed = True
+
+    def window(self, left, bottom, right, top):
+        return from_bounds(left, bottom, right, top, self.transform)
+
+    def window_transform(self, window):
+        return transform(window, self.transform)
+
+    def window_bounds(self, window):
+        return bounds(window, self.transform)
+
+    def read(self, indexes=None, window=None, out=None):
+        """Read data from the hot store.
+
+        Parameters
+        ----------
+        indexes : int or list of ints, optional (default: None)
+            1-based band index(es) to read; if None, all bands are read
+        window : rasterio.windows.Window, optional (default: None)
+            must be within the extent of the hot store
+        out : ndarray, optional (default: None)
+            if provided, data are copied into this array
+
+        Returns
+        -------
+        ndarray
+            read-only view of the data unless out is provided; 2d array if
+            indexes is an int, otherwise 3d array
+        """
+        if window is None:
+            rows = slice(0, self.height)
+            cols = slice(0, self.width)
+        else:
+            row_off = int(window.row_off)
+            col_off = int(window.col_off)
+            rows = slice(row_off, row_off + int(window.height))
+            cols = slice(col_off, col_off + int(window.width))
+
+        if indexes is None:
+            data = self.data[:, rows, cols]
+        elif isinstance(indexes, int):
+            data = self.data[indexes - 1, rows, cols]
+        else:
+            data = self.data[np.asarray(indexes) - 1, rows, cols]
+
+        if out is not None:
+            out[:] = data
+            return out
+
+        return data
+
+
+def open_hot_store(filename):
+    """Open the hot store of a raster if it has been created and is up to date
+    with the raster.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    HotStoreDataset or None
+    """
+    filename = str(filename)
+    array_filename, manifest_filename = get_hot_store_filenames(filename)
+
+    if not manifest_filename.exists():
+        return None
+
+    with open(manifest_filename) as f:
+        manifest = json.loads(f.read())
+
+    stat = os.stat(filename)
+    if manifest["source"] != {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}:
+        return None
+
+    return HotStoreDataset(filename, array_filename, manifest)
+
+
+def open_raster(filename):
+    """Open a raster for reading, using its hot store if available.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    HotStoreDataset or open rasterio dataset
+    """
+    dataset = open_hot_store(filename)
+    if dataset is None:
+        dataset = rasterio.open(filename)
+
+    return dataset
@@ -0,0 +1,237 @@
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+
+import numpy as np
+from rasterio.windows import Window
+import shapely
+
+from analysis.lib.raster import SpanGeometryMask, WindowGeometryMask
+
+
+# increment when the way that masks are created changes, to invalidate
+# previously cached masks
+CACHE_VERSION = 4
+
+# kinds of masks stored in the cache
+WINDOW_MASK = 0
+SPAN_MASK = 1
+
+# scan the cache directory to remove least recently used entries at least this
+# often, since other processes also write to it
+EVICT_INTERVAL = 100
+
+
+class MaskCache(object):
+    """Content-addressed cache on disk of rasterized geometry masks and their
+    read windows, keyed by a hash of the normalized geometry and the identity of
+    the raster used to create the masks.
+
+    Masks are stored bit-packed, or as row spans for SpanGeometryMask.  Least
+    recently used entries are removed once the total size of the cache exceeds
+    max_size.
+
+    The size of the cache is estimated from the entries written by this
+    process, and the cache directory is only scanned when the estimate exceeds
+    max_size or after EVICT_INTERVAL writes.
+    """
+
+    def __init__(self, path, max_size):
+        """
+        Parameters
+        ----------
+        path : str or Path
+            directory in which to store cached masks
+        max_size : int
+            maximum total size of cached masks in bytes
+        """
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.max_size = max_size
+
+        # estimated total size of cache; None until the cache is scanned
+        self.size = None
+        self.writes = 0
+
+    def get_key(self, geometry, dataset, *args):
+        """Get the cache key for geometry rasterized against dataset.
+
+        Parameters
+        ----------
+        geometry : shapely geometry
+        dataset : open rasterio dataset
+        *args : additional values that affect the masks (e.g., window size)
+
+        Returns
+        -------
+        str
+        """
+        stat = os.stat(dataset.name)
+
+        key = hashlib.sha256()
+        key.update(shapely.to_wkb(shapely.normalize(geometry)))
+        key.update(
+            repr(
+                (
+                    CACHE_VERSION,
+                    dataset.name,
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                    tuple(dataset.transform),
+                    dataset.width,
+                    dataset.height,
+                )
+                + args
+            ).encode("UTF8")
+        )
+
+        return key.hexdigest()
+
+    def get(self, key, dataset):
+        """Get cached masks
+
+        Parameters
+        ----------
+        key : str
+        dataset : open rasterio dataset
+            dataset used to create the masks
+
+        Returns
+        -------
+        list of WindowGeometryMask or SpanGeometryMask, or None
+            None if key is not in the cache
+        """
+        filename = self.path / f"{key}.npz"
+
+        try:
+            with np.load(filename) as data:
+                windows = data["windows"]
+                kinds = data["kinds"]
+                offsets = data["offsets"]
+                packed = data["masks"]
+                span_offsets = data["span_offsets"]
+                spans = data["spans"]
+
+            # mark as recently used
+            os.utime(filename)
+
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+
+        masks = []
+        for i, (col_off, row_off, width, height) in enumerate(windows):
+            window = Window(int(col_off), int(row_off), int(width), int(height))
+
+            # masks are stored either as bit-packed masks or as row spans
+            if kinds[i] == SPAN_MASK:
+                rows, starts, ends = spans[span_offsets[i] : span_offsets[i + 1]].T
+                masks.append(
+                    SpanGeometryMask.from_spans(dataset, window, rows, starts, ends)
+                )
+
+            else:
+                shape_mask = (
+                    np.unpackbits(
+                        packed[offsets[i] : offsets[i + 1]], count=int(width * height)
+                    )
+                    .view(bool)
+                    .reshape((height, width))
+                )
+                masks.append(
+                    WindowGeometryMask.from_shape_mask(dataset, window, shape_mask)
+                )
+
+        return masks
+
+    def set(self, key, masks):
+        """Store masks in the cache and remove least recently used entries if
+        the cache is above max_size.
+
+        Parameters
+        ----------
+        key : str
+        masks : list of WindowGeometryMask or SpanGeometryMask
+        """
+        windows = np.array(
+            [
+                [
+                    mask.window.col_off,
+                    mask.window.row_off,
+                    mask.window.width,
+                    mask.window.height,
+                ]
+                for mask in masks
+            ],
+            dtype="int64",
+        ).reshape((-1, 4))
+
+        kinds = np.array(
+            [
+                SPAN_MASK if isinstance(mask, SpanGeometryMask) else WINDOW_MASK
+                for mask in masks
+            ],
+            dtype="uint8",
+        )
+
+        packed = []
+        spans = []
+        for mask in masks:
+            if isinstance(mask, SpanGeometryMask):
+                packed.append(np.array([], dtype="uint8"))
+                spans.append(np.array([mask.rows, mask.starts, mask.ends]).T)
+            else:
+                packed.append(np.packbits(mask.shape_mask, axis=None))
+                spans.append(np.empty((0, 3), dtype="int64"))
+
+        # write to a temporary file and move into place so that other processes
+        # never read a partially written file
+        fd, tmp_filename = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+        with open(fd, "wb") as out:
+            np.savez(
+                out,
+                windows=windows,
+                kinds=kinds,
+                offsets=np.cumsum([0] + [len(p) for p in packed]),
+                masks=np.concatenate(packed) if packed else np.array([], "uint8"),
+                span_offsets=np.cumsum([0] + [len(p) for p in spans]),
+                spans=np.concatenate(spans) if spans else np.empty((0, 3), "int64"),
+            )
+
+        size = os.stat(tmp_filename).st_size
+        os.replace(tmp_filename, self.path / f"{key}.npz")
+
+        self.writes += 1
+        if self.size is not None:
+            self.size += size
+
+        if (
+            self.size is None
+            or self.size > self.max_size
+            or self.writes >= EVICT_INTERVAL
+        ):
+            self.evict()
+
+    def evict(self):
+        """Scan the cache and remove least recently used entries until the
+        total size of the cache is at or below max_size."""
+        entries = []
+        for filename in self.path.glob("*.npz"):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            # may have already been removed by another process
+            filename.unlink(missing_ok=True)
+            total_size -= size
+
+        self.size = total_size
+        self.writes = 0
@@ -1,22 +1,45 @@
-from itertools import product
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+import json
 import math
+import os
+import threading
 
 from affine import Affine
 import numpy as np
 import rasterio
 from rasterio.enums import Resampling
+from rasterio.features import rasterize
 from rasterio.mask import geometry_mask
 from rasterio.vrt import WarpedVRT
 from rasterio.windows import Window
 import shapely
 
 from analysis.constants import OVERVIEW_FACTORS, DATA_CRS
+from analysis.lib.dataset_pool import open_dataset
+from analysis.lib.hot_store import HotStoreDataset
 from api.settings import SHARED_DATA_DIR
 
 data_dir = SHARED_DATA_DIR / "inputs"
 extent_filename = data_dir / "boundaries/blueprint_extent.tif"
 extent_mask_filename = data_dir / "boundaries/blueprint_extent_mask.tif"
 
+# maximum number of values counted at a time by np.bincount, which upcasts them
+# to 64 bit integers (8 MB)
+BINCOUNT_CHUNK_SIZE = 1 << 20
+
+# approximate number of rows read at a time for masks that are read in strips;
+# rounded to a multiple of the block height of the dataset
+STRIP_HEIGHT = 256
+
+# windows with more pixels than this are read in strips to limit memory
+STREAMING_MIN_PIXELS = 2048 * 2048
+
+# spans are assigned individually when creating dense masks from row spans if
+# there is less than one span per this many pixels; otherwise the mask is
+# decoded from runs of pixels, which is faster than assigning many spans
+SPAN_ASSIGN_MIN_PIXELS = 4096
+
 
 def get_window(dataset, bounds, boundless=True):
     """Calculate the window into dataset that contains bounds, for boundless reading.
@@ -82,6 +105,171 @@ def clip_window(window, max_width, max_height):
     return Window(col_off, row_off, width, height)
 
 
+def get_clipped_read_window(dataset, window):
+    """Clip a potentially boundless window to the extent of dataset, for reading
+    only the part of the window that is within dataset without using a
+    boundless read.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    window : rasterio.windows.Window
+
+    Returns
+    -------
+    tuple of (rasterio.windows.Window, (slice of rows, slice of cols))
+        clipped window and the slices of rows and columns of the original window
+        that correspond to the clipped window; window has 0 width or height if
+        it does not overlap dataset
+    """
+    window = Window(
+        int(round(window.col_off)),
+        int(round(window.row_off)),
+        int(round(window.width)),
+        int(round(window.height)),
+    )
+    clipped = clip_window(window, max_width=dataset.width, max_height=dataset.height)
+
+    row_start = clipped.row_off - window.row_off
+    col_start = clipped.col_off - window.col_off
+
+    return clipped, (
+        slice(row_start, row_start + clipped.height),
+        slice(col_start, col_start + clipped.width),
+    )
+
+
+def get_strips(dataset, window):
+    """Split window into strips of rows aligned to the internal block height of
+    dataset, so that each block is only decoded for a single strip.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    window : rasterio.windows.Window
+        must be within the extent of dataset
+
+    Returns
+    -------
+    list of (row_start, row_end)
+        absolute row offsets of each strip within dataset; row_end is exclusive
+    """
+    block_height = dataset.block_shapes[0][0]
+    strip_height = block_height * max(STRIP_HEIGHT // block_height, 1)
+
+    row_start = int(window.row_off)
+    row_end = row_start + int(window.height)
+
+    # boundaries between strips fall on multiples of strip height
+    boundaries = list(
+        range(
+            (row_start // strip_height + 1) * strip_height,
+            row_end,
+            strip_height,
+        )
+    )
+    starts = [row_start] + boundaries
+    ends = boundaries + [row_end]
+
+    return list(zip(starts, ends))
+
+
+def get_block_offsets(offset, size, block_size):
+    """Get the start and end offsets within a window of the internal blocks of
+    a dataset along one dimension.
+
+    Parameters
+    ----------
+    offset : int
+        offset of window within dataset
+    size : int
+        size of window
+    block_size : int
+        size of blocks in dataset
+
+    Returns
+    -------
+    tuple of (ndarray of starts, ndarray of ends)
+        offsets relative to start of window; end is exclusive
+    """
+    first = block_size - (offset % block_size)
+    starts = np.append([0], np.arange(first, size, block_size))
+    ends = np.append(starts[1:], [size])
+
+    return starts, ends
+
+
+def iter_occupied_block_windows(dataset, window, mask):
+    """Split window into windows that only cover the internal blocks of dataset
+    that contain pixels within mask, so that other blocks are not read or
+    decoded.
+
+    Adjacent blocks in a row of blocks are combined into a single window, as are
+    consecutive rows of blocks that cover the same columns.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    window : rasterio.windows.Window
+        must be within the extent of dataset
+    mask : 2d boolean ndarray
+        True for pixels to read; must have same shape as window
+
+    Yields
+    ------
+    tuple of (rasterio.windows.Window, 2d boolean ndarray)
+        window within the extent of dataset and subset of mask for that window
+    """
+    block_height, block_width = dataset.block_shapes[0]
+    row_off = int(window.row_off)
+    col_off = int(window.col_off)
+
+    row_starts, row_ends = get_block_offsets(row_off, mask.shape[0], block_height)
+    col_starts, col_ends = get_block_offsets(col_off, mask.shape[1], block_width)
+
+    # determine which blocks contain pixels within mask
+    occupied = np.array(
+        [
+            np.logical_or.reduceat(mask[start:end].any(axis=0), col_starts)
+            for start, end in zip(row_starts, row_ends)
+        ]
+    )
+
+    if occupied.all():
+        yield window, mask
+        return
+
+    # combine consecutive rows of blocks that have the same occupied blocks
+    row_groups = np.append(
+        [0], np.flatnonzero((occupied[1:] != occupied[:-1]).any(axis=1)) + 1
+    )
+    for group_start, group_end in zip(
+        row_groups, np.append(row_groups[1:], [len(occupied)])
+    ):
+        row_start = row_starts[group_start]
+        row_end = row_ends[group_end - 1]
+
+        # find runs of adjacent occupied blocks
+        changes = np.diff(
+            np.concatenate([[0], occupied[group_start], [0]]).astype("int8")
+        )
+        for run_start, run_end in zip(
+            np.flatnonzero(changes == 1), np.flatnonzero(changes == -1)
+        ):
+            col_start = col_starts[run_start]
+            col_end = col_ends[run_end - 1]
+
+            yield (
+                Window(
+                    col_off + col_start,
+                    row_off + row_start,
+                    col_end - col_start,
+                    row_end - row_start,
+                ),
+                mask[row_start:row_end, col_start:col_end],
+            )
+
+
 def shift_window(window, window_transform, transform):
     """Shift window based on one transform to a window appropriate for a different
     transform.
@@ -138,7 +326,7 @@ def detect_data(datasets, shapes, bounds):
     ----------
     datasets : dict
         {<id>: <filename>, ...}
-    shapes : list-like of GeoJSON features
+    shapes : list-like of GeoJSON features or shapely geometries
     bounds : list-like of [xmin, ymin, xmax, ymax]
 
     Returns
@@ -147,7 +335,7 @@ def detect_data(datasets, shapes, bounds):
         {<id>: True if there are data pixels present in shapes, otherwise False}
     """
 
-    with rasterio.open(extent_mask_filename) as src:
+    with open_dataset(extent_mask_filename) as src:
         window = get_window(src, bounds)
 
         # fail fast if no overlap with data extent
@@ -168,23 +356,154 @@ def detect_data(datasets, shapes, bounds):
 
     available_datasets = {}
     for id, filename in datasets.items():
-        with rasterio.open(filename) as src:
-            read_window = shift_window(window, transform, src.transform)
-            clipped_window = clip_window(
-                read_window, max_width=src.width, max_height=src.height
+        with open_dataset(filename) as src:
+            read_window, (rows, cols) = get_clipped_read_window(
+                src, shift_window(window, transform, src.transform)
             )
-            if clipped_window.width == 0 or clipped_window.height == 0:
+            if read_window.width == 0 or read_window.height == 0:
                 available_datasets[id] = False
                 continue
 
-            data = src.read(1, window=read_window, boundless=True)
+            data = src.read(1, window=read_window)
             available_datasets[id] = np.any(
-                data[~(mask | (data == np.uint8(src.nodata)))]
+                data[~(mask[rows, cols] | (data == np.uint8(src.nodata)))]
             ).item()
 
     return available_datasets
 
 
+def get_source_signature(filename):
+    """Get the modification time and size of a source file, used to detect if
+    files derived from it are out of date.
+
+    Parameters
+    ----------
+    filename : str or Path
+
+    Returns
+    -------
+    dict
+        {"mtime_ns": <mtime_ns>, "size": <size>}, or None if file does not
+        exist
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def detect_data_from_availability(filename, datasets, shapes, bounds):
+    """Detect if any data pixels are found in shapes for all datasets encoded in
+    a dataset availability raster (see create_availability_raster), using a
+    single read.
+
+    Only datasets whose low resolution masks are unchanged since the
+    availability raster was created are included in the results; others must
+    be checked against their masks using detect_data.
+
+    Parameters
+    ----------
+    filename : str or Path
+        dataset availability raster
+    datasets : dict
+        {<id>: <low resolution mask filename>, ...}
+    shapes : list-like of GeoJSON features or shapely geometries
+    bounds : list-like of [xmin, ymin, xmax, ymax]
+
+    Returns
+    -------
+    dict
+        {<id>: True if there are data pixels present in shapes, otherwise False}
+    """
+    with open_dataset(filename) as src:
+        tags = src.tags()
+        ids = tags["datasets"].split(",")
+        sources = json.loads(tags.get("sources", "{}"))
+
+        # only use bits of datasets that are up to date with their masks
+        current = {
+            i: id
+            for i, id in enumerate(ids)
+            if id in datasets
+            and id in sources
+            and sources[id] == get_source_signature(datasets[id])
+        }
+        if not current:
+            return {}
+
+        window = get_window(src, bounds)
+        read_window, (rows, cols) = get_clipped_read_window(src, window)
+
+        # fail fast if no overlap with data extent
+        if read_window.width == 0 or read_window.height == 0:
+            return {id: False for id in current.values()}
+
+        # note: this intentionally uses all_touched=True
+        mask = geometry_mask(
+            shapes,
+            transform=src.window_transform(window),
+            out_shape=(window.height, window.width),
+            all_touched=True,
+            invert=True,
+        )
+
+        data = src.read(1, window=read_window)
+
+    # combine bits of all pixels in shapes
+    bits = np.bitwise_or.reduce(data[mask[rows, cols]]).item()
+
+    return {id: bool(bits & (1 << i)) for i, id in current.items()}
+
+
+def create_availability_raster(datasets, outfilename):
+    """Create a low resolution raster aligned to the extent mask where each bit of
+    the value of a pixel indicates if the low resolution mask of one dataset has
+    data in that pixel.
+
+    The order of dataset IDs (the first ID is the lowest bit) is stored in the
+    "datasets" tag of the raster, and the modification time and size of each
+    mask are stored in the "sources" tag so that datasets whose masks are
+    modified afterwards are not read from it.
+
+    Parameters
+    ----------
+    datasets : dict
+        {<id>: <low resolution mask filename>, ...}; at most 32 datasets
+    outfilename : str
+    """
+    if len(datasets) > 32:
+        raise ValueError("At most 32 datasets can be encoded in availability raster")
+
+    with rasterio.open(extent_mask_filename) as extent:
+        transform = extent.transform
+        window = Window(0, 0, extent.width, extent.height)
+        meta = extent.profile.copy()
+
+    bits = np.zeros((window.height, window.width), dtype="uint32")
+    sources = {}
+
+    for i, (id, filename) in enumerate(datasets.items()):
+        sources[id] = get_source_signature(filename)
+
+        with rasterio.open(filename) as src:
+            read_window, (rows, cols) = get_clipped_read_window(
+                src, shift_window(window, transform, src.transform)
+            )
+            if read_window.width == 0 or read_window.height == 0:
+                continue
+
+            data = src.read(1, window=read_window)
+            has_data = (data != np.uint8(src.nodata)) & (data != 0)
+            bits[rows, cols] |= has_data.astype("uint32") << i
+
+    meta.update({"dtype": "uint32", "nodata": None, "compress": "lzw"})
+    with rasterio.open(outfilename, "w", **meta) as out:
+        out.write(bits, 1)
+        out.update_tags(datasets=",".join(datasets.keys()), sources=json.dumps(sources))
+
+
 def create_lowres_mask(filename, outfilename, resolution, ignore_zero=False):
     """Create a resampled lower resolution mask.
 
@@ -305,6 +624,65 @@ def write_raster(filename, data, transform, crs, nodata):
         out.write(data, 1)
 
 
+def write_band_stack(filenames, outfilename, descriptions=None, window_size=2048):
+    """Combine single-band rasters into a multi-band, pixel-interleaved GeoTIFF
+    so that a single windowed read returns all bands.
+
+    All rasters must have the same dimensions, transform, data type, and nodata
+    value.
+
+    Parameters
+    ----------
+    filenames : list-like of str or Path
+        one filename per band, in band order
+    outfilename : str or Path
+    descriptions : list-like of str, optional (default: None)
+        description of each band (e.g., year)
+    window_size : int, optional (default: 2048)
+        number of rows to read and write at a time
+    """
+    with ExitStack() as stack:
+        srcs = [stack.enter_context(rasterio.open(filename)) for filename in filenames]
+
+        src = srcs[0]
+        for other in srcs[1:]:
+            if (
+                other.transform != src.transform
+                or other.shape != src.shape
+                or other.dtypes[0] != src.dtypes[0]
+                or other.nodata != src.nodata
+            ):
+                raise ValueError(f"{other.name} does not match {src.name}")
+
+        meta = {
+            "driver": "GTiff",
+            "dtype": src.dtypes[0],
+            "nodata": src.nodata,
+            "width": src.width,
+            "height": src.height,
+            "count": len(srcs),
+            "crs": src.crs,
+            "transform": src.transform,
+            "compress": "lzw",
+            "interleave": "pixel",
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+        }
+
+        with rasterio.open(outfilename, "w", **meta) as out:
+            for row_off in range(0, src.height, window_size):
+                window = Window(
+                    0, row_off, src.width, min(window_size, src.height - row_off)
+                )
+                for band, band_src in enumerate(srcs, start=1):
+                    out.write(band_src.read(1, window=window), band, window=window)
+
+            if descriptions is not None:
+                for band, description in enumerate(descriptions, start=1):
+                    out.set_band_description(band, str(description))
+
+
 def window_overlaps(window, dataset):
     """Verify that window overlaps with extent of dataset
 
@@ -341,7 +719,7 @@ def get_overlapping_windows(src, geometry, bounds, window_size):
 
     tuple of:
         (
-            ndarray of rasterio.windows.Window,
+            list of rasterio.windows.Window,
             ratio of number of overlapping windows to total number of windows in extent
         )
     """
@@ -373,28 +751,752 @@ def get_overlapping_windows(src, geometry, bounds, window_size):
         src.width,
     )
 
-    windows = [
-        Window(row_off=row_off, col_off=col_off, width=window_size, height=window_size)
-        for row_off, col_off in product(
-            range(start_row, end_row, window_size),
-            range(start_col, end_col, window_size),
-        )
-    ]
+    # calculate offsets and bounds of all windows from the transform; dataset
+    # must not be rotated
+    row_offs, col_offs = np.meshgrid(
+        np.arange(start_row, end_row, window_size),
+        np.arange(start_col, end_col, window_size),
+        indexing="ij",
+    )
+    row_offs = row_offs.ravel()
+    col_offs = col_offs.ravel()
 
-    total_windows = len(windows)
+    total_windows = len(row_offs)
 
     if total_windows == 0:
         return [], 0
 
-    window_boxes = shapely.box(*np.array([src.window_bounds(w) for w in windows]).T)
+    transform = src.transform
+    window_boxes = shapely.box(
+        transform.c + col_offs * transform.a,
+        transform.f + (row_offs + window_size) * transform.e,
+        transform.c + (col_offs + window_size) * transform.a,
+        transform.f + row_offs * transform.e,
+    )
     shapely.prepare(geometry)
     ix = shapely.intersects(geometry, window_boxes)
-    windows = np.array(windows)[ix]
+
+    # only create windows that intersect geometry
+    windows = [
+        Window(row_off=row_off, col_off=col_off, width=window_size, height=window_size)
+        for row_off, col_off in zip(row_offs[ix].tolist(), col_offs[ix].tolist())
+    ]
 
     return windows, len(windows) / total_windows
 
 
-class WindowGeometryMask(object):
+class ReadBufferPool(object):
+    """Pool of reusable flat arrays for reading raster windows, keyed by data
+    type.
+
+    Each buffer grows to fit the largest window read into it, and windows of
+    any shape are read into a view of its first pixels, so the number of
+    buffers is limited to the number of concurrent reads rather than the number
+    of distinct window shapes.
+
+    Intended to be scoped to a single job so that the buffers are released
+    when the job is complete.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = defaultdict(list)
+
+    @contextmanager
+    def get(self, shape, dtype):
+        """Get a buffer from the pool, or create it if none are available.  The
+        buffer is returned to the pool on exit.
+
+        Parameters
+        ----------
+        shape : tuple of ints
+        dtype : str or numpy dtype
+
+        Yields
+        ------
+        ndarray
+            uninitialized array of shape and dtype
+        """
+        key = np.dtype(dtype).str
+        size = math.prod(shape)
+
+        with self.lock:
+            buffers = self.buffers[key]
+            buffer = buffers.pop() if buffers else None
+
+        if buffer is None or buffer.size < size:
+            buffer = np.empty((size,), dtype=dtype)
+
+        try:
+            yield buffer[:size].reshape(shape)
+
+        finally:
+            with self.lock:
+                # keep the largest buffers at the end of the list so that they
+                # are used first
+                buffers = self.buffers[key]
+                buffers.append(buffer)
+                buffers.sort(key=lambda buffer: buffer.size)
+
+    @property
+    def nbytes(self):
+        """Total size of the buffers in the pool, in bytes."""
+        with self.lock:
+            return sum(
+                buffer.nbytes for buffers in self.buffers.values() for buffer in buffers
+            )
+
+    def clear(self):
+        """Release all buffers in the pool."""
+        with self.lock:
+            self.buffers = defaultdict(list)
+
+
+@contextmanager
+def read_into_buffer(dataset, window, indexes=None, buffers=None):
+    """Read data from dataset within window, using a buffer from buffers if
+    provided.
+
+    The data must not be used outside this context, since the buffer is
+    returned to the pool on exit.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    window : rasterio.windows.Window
+        must be within the extent of dataset
+    indexes : int, optional (default: None)
+        band to read; if None, all bands are read
+    buffers : ReadBufferPool, optional (default: None)
+
+    Yields
+    ------
+    ndarray
+        2d array if indexes is an int, otherwise 3d array
+    """
+    # hot stores are read without copying, so buffers are not needed
+    if buffers is None or isinstance(dataset, HotStoreDataset):
+        yield dataset.read(indexes, window=window)
+        return
+
+    shape = (int(window.height), int(window.width))
+    if indexes is None:
+        shape = (dataset.count,) + shape
+
+    with buffers.get(shape, dataset.dtypes[0]) as out:
+        yield dataset.read(indexes, window=window, out=out)
+
+
+def count_values_in_mask(data, mask, nodata, num_bins):
+    """Count the values of data within mask, excluding NODATA values.
+
+    Instead of building boolean arrays for NODATA and combining them with the
+    mask, only the values within the mask are extracted (or the data are used
+    directly if all pixels are within the mask).  These are counted in chunks
+    so that the values upcast by np.bincount occupy a bounded amount of memory,
+    and the count for NODATA is dropped from each chunk.
+
+    Parameters
+    ----------
+    data : 2d ndarray of unsigned integers
+    mask : 2d boolean ndarray
+        True where pixels are within the geometry; must be same shape as data
+    nodata : int
+    num_bins : int
+        number of bins to return; values >= num_bins are not counted
+
+    Returns
+    -------
+    ndarray
+        number of pixels for each value from 0 to num_bins - 1
+    """
+    values = data.ravel() if mask.all() else data[mask]
+
+    counts = np.zeros((num_bins,), dtype="int64")
+    for start in range(0, len(values), BINCOUNT_CHUNK_SIZE):
+        chunk_counts = np.bincount(values[start : start + BINCOUNT_CHUNK_SIZE])
+
+        if nodata < len(chunk_counts):
+            chunk_counts[nodata] = 0
+
+        size = min(num_bins, len(chunk_counts))
+        counts[:size] += chunk_counts[:size]
+
+    return counts
+
+
+def get_row_spans(geometry, transform, shape):
+    """Rasterize polygon geometry into spans of columns within each row using a
+    scanline algorithm.
+
+    This follows the rules used by GDAL when rasterizing polygons with
+    all_touched=False, so that spans are identical to geometry_mask even where
+    edges or vertices fall exactly on pixel centers:
+
+    * edges cross the center of a row if it is at or below their upper endpoint
+      and above their lower endpoint
+    * a pixel is within a span if its center is right of the start crossing
+      and at or left of the end crossing
+    * horizontal edges exactly on the center of a row are filled if they are on
+      the bottom of their ring
+
+    Polygons are filled using the even-odd rule, so holes are excluded.
+
+    Parameters
+    ----------
+    geometry : shapely Polygon or MultiPolygon
+    transform : affine.Affine
+        transform of the upper left corner of the area to rasterize
+    shape : tuple of (height, width)
+
+    Returns
+    -------
+    tuple of (rows, starts, ends)
+        ndarrays of row index, start column (inclusive), and end column
+        (exclusive) of each span, sorted by row then start column; spans do
+        not overlap
+    """
+    height, width = shape
+
+    rings = shapely.get_rings(shapely.get_parts(geometry))
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+
+    # convert to pixel coordinates using the same floating point operations as
+    # GDAL's inverse geotransform, so that coordinates that fall exactly on
+    # pixel centers are treated the same way
+    if transform.b == 0 and transform.d == 0:
+        x = -transform.c / transform.a + coords[:, 0] * (1.0 / transform.a)
+        y = -transform.f / transform.e + coords[:, 1] * (1.0 / transform.e)
+    else:
+        x, y = ~transform * (coords[:, 0], coords[:, 1])
+
+    # extract edges between consecutive vertices of each ring
+    ix = ring_index[:-1] == ring_index[1:]
+    ccw = shapely.is_ccw(rings)[ring_index[:-1][ix]]
+    x0 = x[:-1][ix]
+    y0 = y[:-1][ix]
+    x1 = x[1:][ix]
+    y1 = y[1:][ix]
+
+    # horizontal edges on the bottom of a ring (leftward for clockwise rings in
+    # projected coordinates, rightward for counterclockwise rings) that are
+    # exactly on the center of a row are filled in addition to the spans
+    # between crossings
+    horizontal = (y0 == y1) & ((x0 > x1) != ccw) & (y0 - 0.5 == np.floor(y0 - 0.5))
+    horizontal_rows = (y0[horizontal] - 0.5).astype("int64")
+    horizontal_starts, horizontal_ends = np.clip(
+        np.floor(np.sort([x0[horizontal], x1[horizontal]], axis=0) + 0.5),
+        0,
+        width,
+    ).astype("int64")
+
+    # order endpoints of each edge from top to bottom of the raster
+    swap = y0 > y1
+    x0, x1 = np.where(swap, x1, x0), np.where(swap, x0, x1)
+    y0, y1 = np.where(swap, y1, y0), np.where(swap, y0, y1)
+
+    # each edge crosses the centers of rows in [first_row, last_row); the upper
+    # endpoint is included and the lower endpoint is excluded so that crossings
+    # at shared vertices are only counted once
+    first_row = np.clip(np.ceil(y0 - 0.5), 0, height).astype("int64")
+    last_row = np.clip(np.ceil(y1 - 0.5), 0, height).astype("int64")
+    num_rows = np.maximum(last_row - first_row, 0)
+
+    # calculate x coordinate where each edge crosses the center of each row
+    edge = np.repeat(np.arange(len(num_rows)), num_rows)
+    rows = first_row[edge] + (
+        np.arange(len(edge)) - np.repeat(np.cumsum(num_rows) - num_rows, num_rows)
+    )
+    crossings = (rows + 0.5 - y0[edge]) * (x1[edge] - x0[edge]) / (
+        y1[edge] - y0[edge]
+    ) + x0[edge]
+
+    # pixel centers must be within (start crossing, end crossing], so convert
+    # crossings to the first column right of each crossing
+    cols = np.clip(np.floor(crossings + 0.5), 0, width).astype("int64")
+
+    # sort crossings by row then column; each row has an even number of
+    # crossings, and pixels between alternating pairs of crossings are within
+    # the geometry.  Sorting by rounded column produces the same spans as
+    # sorting by the crossings, and sorting a single integer key is much faster.
+    keys = np.sort(rows * (width + 1) + cols)
+    rows = keys[::2] // (width + 1)
+    starts = keys[::2] % (width + 1)
+    ends = keys[1::2] % (width + 1)
+
+    if len(horizontal_rows):
+        rows = np.concatenate([rows, horizontal_rows])
+        starts = np.concatenate([starts, horizontal_starts])
+        ends = np.concatenate([ends, horizontal_ends])
+
+    ix = (rows >= 0) & (rows < height) & (ends > starts)
+    rows = rows[ix]
+    starts = starts[ix]
+    ends = ends[ix]
+
+    if len(horizontal_rows) and len(rows):
+        # horizontal edges may overlap other spans; merge overlapping spans
+        order = np.lexsort((starts, rows))
+        rows = rows[order]
+        starts = starts[order]
+        ends = ends[order]
+
+        # offset by row so that spans in later rows are never merged with
+        # those in earlier rows
+        offset = rows * (width + 1)
+        prev_end = np.maximum.accumulate(ends + offset)
+        group_starts = np.flatnonzero(
+            np.append([True], starts[1:] + offset[1:] > prev_end[:-1])
+        )
+        rows = rows[group_starts]
+        starts = starts[group_starts]
+        ends = np.maximum.reduceat(ends, group_starts)
+
+    return rows, starts, ends
+
+
+def get_span_mask(rows, starts, ends, row_slice, col_slice, out=None):
+    """Create a dense geometry mask for a subset of the area covered by row
+    spans.
+
+    Parameters
+    ----------
+    rows, starts, ends : ndarrays
+        row, start column (inclusive), and end column (exclusive) of each
+        non-overlapping span, sorted by row then start column
+    row_slice : slice
+    col_slice : slice
+    out : 2d boolean ndarray, optional (default: None)
+        if provided, pixels within spans are set to True in this array, which
+        must have the shape of row_slice and col_slice; other pixels are not
+        changed
+
+    Returns
+    -------
+    2d boolean ndarray
+    """
+    height = row_slice.stop - row_slice.start
+    width = col_slice.stop - col_slice.start
+
+    left, right = np.searchsorted(rows, [row_slice.start, row_slice.stop])
+    span_rows = rows[left:right] - row_slice.start
+    starts = np.maximum(starts[left:right] - col_slice.start, 0)
+    ends = np.minimum(ends[left:right] - col_slice.start, width)
+    ix = ends > starts
+    span_rows = span_rows[ix]
+    starts = starts[ix]
+    ends = ends[ix]
+
+    # assign spans directly if there are few of them
+    if len(span_rows) * SPAN_ASSIGN_MIN_PIXELS < height * width:
+        if out is None:
+            out = np.zeros((height, width), dtype="bool")
+
+        for row, start, end in zip(span_rows.tolist(), starts.tolist(), ends.tolist()):
+            out[row, start:end] = True
+
+        return out
+
+    # otherwise decode the mask from the lengths of alternating runs of pixels
+    # outside and inside spans, which is possible because spans are sorted and
+    # do not overlap
+    offsets = span_rows * width
+    bounds = np.empty((2 * len(span_rows),), dtype="int64")
+    bounds[::2] = offsets + starts
+    bounds[1::2] = offsets + ends
+    values = np.zeros((len(bounds) + 1,), dtype="bool")
+    values[1::2] = True
+    lengths = np.diff(bounds, prepend=0, append=height * width)
+    mask = np.repeat(values, lengths).reshape((height, width))
+
+    if out is None:
+        return mask
+
+    out |= mask
+    return out
+
+
+def block_geometry_masks(dataset, windows, geometry):
+    """Create geometry masks for windows by classifying each internal block of
+    dataset within the windows as inside, outside, or on the boundary of
+    geometry, and only rasterizing the boundary blocks.
+
+    Pixels in blocks inside geometry are True and those in blocks outside
+    geometry are False without rasterizing them.  Windows that are entirely
+    inside or outside geometry are returned as read-only views of a single
+    value instead of allocating a mask.  Blocks of all windows are classified
+    together.
+
+    Boundary blocks are filled from row spans of the full geometry (see
+    get_row_spans), which are created once for the area covered by all windows
+    and follow the same rules as rasterizing each window in its entirety.
+    Masks are identical to those created by geometry_mask as long as pixel
+    coordinates relative to each window and to the area covered by all windows
+    differ by exactly the window offsets, which is the case for datasets with
+    an origin that is a multiple of half their resolution.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    windows : list-like of rasterio.windows.Window
+    geometry : shapely Polygon or MultiPolygon
+
+    Returns
+    -------
+    list of 2d boolean ndarrays
+        True for pixels within geometry; same shapes as windows
+    """
+    if len(windows) == 0:
+        return []
+
+    block_height, block_width = dataset.block_shapes[0]
+
+    shapes = []
+    transforms = []
+    # block offsets within each window: (window index, row start, row end,
+    # col start, col end)
+    blocks = []
+    for i, window in enumerate(windows):
+        height = int(window.height)
+        width = int(window.width)
+        shapes.append((height, width))
+        transforms.append(dataset.window_transform(window))
+
+        row_starts, row_ends = get_block_offsets(
+            int(window.row_off), height, block_height
+        )
+        col_starts, col_ends = get_block_offsets(
+            int(window.col_off), width, block_width
+        )
+        block_rows, block_cols = np.meshgrid(
+            np.arange(len(row_starts)), np.arange(len(col_starts)), indexing="ij"
+        )
+        blocks.append(
+            np.stack(
+                [
+                    np.full(block_rows.size, i),
+                    row_starts[block_rows.ravel()],
+                    row_ends[block_rows.ravel()],
+                    col_starts[block_cols.ravel()],
+                    col_ends[block_cols.ravel()],
+                ],
+                axis=1,
+            )
+        )
+
+    # index of first block of each window
+    window_blocks = np.cumsum([0] + [len(b) for b in blocks[:-1]])
+    window_ix, row_starts, row_ends, col_starts, col_ends = np.concatenate(blocks).T
+
+    # create boxes for all blocks; dataset must not be rotated
+    c, a, f, e = np.array([(t.c, t.a, t.f, t.e) for t in transforms])[window_ix].T
+    xmin = c + col_starts * a
+    xmax = c + col_ends * a
+    ymax = f + row_starts * e
+    ymin = f + row_ends * e
+    boxes = shapely.box(xmin, ymin, xmax, ymax)
+
+    shapely.prepare(geometry)
+    intersects = shapely.intersects(geometry, boxes)
+    inside = intersects & shapely.contains_properly(geometry, boxes)
+    boundary = intersects & ~inside
+
+    all_inside = np.logical_and.reduceat(inside, window_blocks)
+    any_intersects = np.logical_or.reduceat(intersects, window_blocks)
+
+    masks = []
+    for i, shape in enumerate(shapes):
+        if all_inside[i] or not any_intersects[i]:
+            masks.append(np.broadcast_to(all_inside[i], shape))
+        else:
+            masks.append(np.zeros(shape, dtype="bool"))
+
+    for i in np.flatnonzero(inside & ~all_inside[window_ix]):
+        masks[window_ix[i]][
+            row_starts[i] : row_ends[i], col_starts[i] : col_ends[i]
+        ] = True
+
+    if not boundary.any():
+        return masks
+
+    # create row spans once for the area covered by all windows; geometry is
+    # not clipped to the windows or blocks, since clipping changes the rings
+    # that edges on pixel centers belong to
+    row_offs = np.array([int(window.row_off) for window in windows])
+    col_offs = np.array([int(window.col_off) for window in windows])
+    heights, widths = np.array(shapes).T
+    area = Window(
+        col_offs.min(),
+        row_offs.min(),
+        (col_offs + widths).max() - col_offs.min(),
+        (row_offs + heights).max() - row_offs.min(),
+    )
+    rows, starts, ends = get_row_spans(
+        geometry,
+        dataset.window_transform(area),
+        (int(area.height), int(area.width)),
+    )
+    row_offs -= int(area.row_off)
+    col_offs -= int(area.col_off)
+
+    # group adjacent boundary blocks within each row of blocks of each window
+    # (blocks are ordered by window, row, then column)
+    boundary_ix = np.flatnonzero(boundary)
+    runs = defaultdict(list)
+    for i in boundary_ix:
+        key = (window_ix[i], row_starts[i], row_ends[i])
+        if runs[key] and runs[key][-1][1] == col_starts[i]:
+            runs[key][-1][1] = col_ends[i]
+        else:
+            runs[key].append([col_starts[i], col_ends[i]])
+
+    for (i, row_start, row_end), col_runs in runs.items():
+        mask = masks[i]
+        window_rows = slice(row_offs[i] + row_start, row_offs[i] + row_end)
+
+        # only use spans within this row of blocks of the window
+        left, right = np.searchsorted(rows, [window_rows.start, window_rows.stop])
+        ix = (ends[left:right] > col_offs[i]) & (
+            starts[left:right] < col_offs[i] + mask.shape[1]
+        )
+        block_spans = (
+            rows[left:right][ix],
+            starts[left:right][ix] - col_offs[i],
+            ends[left:right][ix] - col_offs[i],
+        )
+
+        for col_start, col_end in col_runs:
+            get_span_mask(
+                *block_spans,
+                window_rows,
+                slice(col_start, col_end),
+                out=mask[row_start:row_end, col_start:col_end],
+            )
+
+    return masks
+
+
+def block_geometry_mask(dataset, window, geometry):
+    """Create a geometry mask for window, only rasterizing the internal blocks
+    of dataset on the boundary of geometry; see block_geometry_masks.
+
+    Parameters
+    ----------
+    dataset : open rasterio dataset
+    window : rasterio.windows.Window
+    geometry : shapely Polygon or MultiPolygon
+
+    Returns
+    -------
+    2d boolean ndarray
+        True for pixels within geometry; same shape as window
+    """
+    return block_geometry_masks(dataset, [window], geometry)[0]
+
+
+def assign_label_layers(geometries):
+    """Assign geometries to layers of labels so that geometries that intersect,
+    including those that only touch, are in different layers.
+
+    Pixels along a shared edge may be within both geometries when they are
+    rasterized individually, so touching geometries cannot share a layer.
+    Geometries are assigned in order to the first layer not used by a previous
+    geometry that they intersect, so the layers of a subset of geometries that
+    only includes the first N layers are unchanged if assigned again in the
+    same order.
+
+    Parameters
+    ----------
+    geometries : ndarray of shapely geometries
+
+    Returns
+    -------
+    ndarray of layer index for each geometry
+    """
+    geometries = np.asarray(geometries)
+    layers = np.zeros(len(geometries), dtype="int64")
+
+    if len(geometries) < 2:
+        return layers
+
+    left, right = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    ix = left < right
+
+    intersecting = defaultdict(list)
+    for i, j in zip(left[ix], right[ix]):
+        intersecting[j].append(i)
+
+    for j in range(len(geometries)):
+        used = {layers[i] for i in intersecting[j]}
+        layer = 0
+        while layer in used:
+            layer += 1
+        layers[j] = layer
+
+    return layers
+
+
+class GeometryMask(object):
+    """Base class for geometry masks with an associated read window for
+    optimized reading from datasets.
+
+    Subclasses provide the parts of the window to read and the geometry mask for
+    each part via iter_mask_windows.  Within these, only the internal blocks of
+    the dataset that contain pixels in the geometry mask are read.
+    """
+
+    def get_read_window(self, dataset):
+        """Get the window into dataset that corresponds to the mask window,
+        clipped to the extent of dataset, and the slices of the mask that
+        correspond to the clipped window.
+
+        Reading the clipped window avoids the much slower boundless reads in
+        rasterio; pixels outside the dataset are NODATA and are not needed.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+
+        Returns
+        -------
+        tuple of (rasterio.windows.Window, (slice of rows, slice of cols))
+            window has 0 width or height if it does not overlap dataset
+        """
+        # DEBUG: check for implementation errors
+        # FIXME: comment out
+        if (
+            dataset.transform.a != self.dataset_transform.a
+            or dataset.transform.e != self.dataset_transform.e
+        ):
+            raise ValueError(
+                f"{dataset.name} resolution does not match that used for mask windows"
+            )
+
+        read_window = (
+            self.window
+            if dataset.transform == self.dataset_transform
+            else shift_window(self.window, self.window_transform, dataset.transform)
+        )
+
+        return get_clipped_read_window(dataset, read_window)
+
+    def iter_mask_windows(self, dataset):
+        """Iterate over the parts of the mask window to read from dataset.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+
+        Yields
+        ------
+        tuple of (rasterio.windows.Window, 2d boolean ndarray)
+            window within the extent of dataset and geometry mask for that window
+        """
+        raise NotImplementedError
+
+    def iter_read_windows(self, dataset):
+        """Iterate over the windows to read from dataset, excluding any internal
+        blocks of dataset that do not contain pixels within the geometry mask.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+
+        Yields
+        ------
+        tuple of (rasterio.windows.Window, 2d boolean ndarray)
+            window within the extent of dataset and geometry mask for that window
+        """
+        for read_window, shape_mask in self.iter_mask_windows(dataset):
+            yield from iter_occupied_block_windows(dataset, read_window, shape_mask)
+
+    def detect_data(self, dataset):
+        """Detect if there are any non-NODATA pixel values in the dataset within
+        the geometry mask.
+
+        Intended to be used for a low-resolution version of the geometry mask
+        and dataset.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+
+        Returns
+        -------
+        bool
+            returns True if there are non-NODATA pixel values present
+        """
+        nodata = getattr(np, dataset.dtypes[0])(dataset.nodata)
+
+        for read_window, shape_mask in self.iter_read_windows(dataset):
+            data = dataset.read(1, window=read_window)
+
+            # if there are non-nodata values within geometry mask, then there
+            # are data
+            if (data[shape_mask] != nodata).any():
+                return True
+
+        return False
+
+    def get_pixel_count_by_bin(self, dataset, bins, buffers=None, histograms=None):
+        """Get count of pixels in each bin
+
+        If dataset has multiple bands (e.g., one band per year), all bands are
+        read at once and counts are returned for each band.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+        bins : list-like
+            List-like of values ranging from 0 to max value (not sparse!).
+            Counts will be generated that correspond to this list of bins.
+        buffers : ReadBufferPool, optional (default: None)
+            if provided, data are read into a buffer from this pool instead of
+            a newly allocated array
+        histograms : BlockHistograms, optional (default: None)
+            if provided, internal blocks of dataset that are entirely within
+            the geometry mask are counted from these precomputed histograms
+            instead of being read
+
+        Returns
+        -------
+        ndarray
+            Total number of pixels for each bin, with shape (bins, ) for
+            single-band datasets or (bands, bins) for multi-band datasets
+        """
+        nodata = getattr(np, dataset.dtypes[0])(dataset.nodata)
+        num_bins = len(bins)
+        # read all bands in a single read
+        indexes = 1 if dataset.count == 1 else None
+
+        counts = np.zeros((dataset.count, num_bins), dtype="int64")
+        for mask_window, mask in self.iter_mask_windows(dataset):
+            if histograms is not None:
+                block_counts, mask = histograms.count_full_blocks(
+                    mask_window, mask, num_bins
+                )
+                counts += block_counts
+
+            for read_window, shape_mask in iter_occupied_block_windows(
+                dataset, mask_window, mask
+            ):
+                with read_into_buffer(dataset, read_window, indexes, buffers) as data:
+                    if indexes == 1:
+                        data = data[np.newaxis]
+
+                    for band, band_data in enumerate(data):
+                        # count values inside geometry except where they are NODATA
+                        counts[band] += count_values_in_mask(
+                            band_data, shape_mask, nodata, num_bins
+                        )
+
+        if dataset.count == 1:
+            return counts[0]
+
+        return counts
+
+
+class WindowGeometryMask(GeometryMask):
     """Geometry mask with an associated read window for optimized
     reading from the dataset
 
@@ -420,54 +1522,277 @@ class WindowGeometryMask(object):
             all_touched=all_touched,
             invert=True,
         )
+        self.pixels = self.shape_mask.sum()
 
-    def detect_data(self, dataset):
-        """Detect if there are any non-NODATA pixel values in the dataset within
-        the geometry mask.
+    @classmethod
+    def from_geometry(cls, dataset, window, geometry):
+        """Create geometry mask by only rasterizing the internal blocks of
+        dataset on the boundary of geometry; see block_geometry_mask.
 
-        Intended to be used for a low-resolution version of the geometry mask
-        and dataset.
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+        window : rasterio.windows.Window
+        geometry : shapely Polygon or MultiPolygon
+
+        Returns
+        -------
+        WindowGeometryMask
+        """
+        return cls.from_shape_mask(
+            dataset, window, block_geometry_mask(dataset, window, geometry)
+        )
+
+    @classmethod
+    def from_shape_mask(cls, dataset, window, shape_mask):
+        """Create from a previously created geometry mask and read window
 
         Parameters
         ----------
         dataset : open rasterio dataset
+        window : rasterio.windows.Window
+        shape_mask : 2d boolean ndarray
+            True for all pixels within geometry; must have same shape as window
 
         Returns
         -------
-        bool
-            returns True if there are non-NODATA pixel values present
+        WindowGeometryMask
         """
-        # DEBUG: check for implementation errors
-        # FIXME: comment out
-        if (
-            dataset.transform.a != self.dataset_transform.a
-            or dataset.transform.e != self.dataset_transform.e
-        ):
-            raise ValueError(
-                f"{dataset.name} resolution does not match that used for mask windows"
+        mask = cls.__new__(cls)
+        mask.dataset_transform = dataset.transform
+        mask.window = window
+        mask.window_transform = dataset.window_transform(window)
+        mask.shape_mask = shape_mask
+        mask.pixels = shape_mask.sum()
+
+        return mask
+
+    def iter_mask_windows(self, dataset):
+        read_window, (rows, cols) = self.get_read_window(dataset)
+        if read_window.width == 0 or read_window.height == 0:
+            return
+
+        if read_window.width * read_window.height <= STREAMING_MIN_PIXELS:
+            yield read_window, self.shape_mask[rows, cols]
+            return
+
+        # stream large windows in strips to limit memory
+        for row_start, row_end in get_strips(dataset, read_window):
+            mask_row_start = rows.start + (row_start - read_window.row_off)
+            mask_rows = slice(mask_row_start, mask_row_start + (row_end - row_start))
+            yield (
+                Window(
+                    read_window.col_off,
+                    row_start,
+                    read_window.width,
+                    row_end - row_start,
+                ),
+                self.shape_mask[mask_rows, cols],
             )
 
-        if dataset.transform == self.dataset_transform:
-            read_window = self.window
 
-        else:
-            read_window = shift_window(
-                self.window, self.window_transform, dataset.transform
+class SpanGeometryMask(GeometryMask):
+    """Compact geometry mask stored as spans of columns within each row, with an
+    associated read window.
+
+    Intended for large windows where a dense mask would require a lot of memory.
+    Data are read in strips of rows aligned to the blocks of the dataset, and
+    only the columns covered by spans in each strip are read; strips without
+    spans are skipped.
+
+    Dense masks of strips are created once and kept bit-packed, so that they
+    are not recreated for each dataset that is read.
+    """
+
+    def __init__(self, dataset, window, geometry):
+        """Create full resolution row span mask and associated read window
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+        window : rasterio.windows.Window
+        geometry : shapely Polygon or MultiPolygon
+        """
+        self.dataset_transform = dataset.transform
+        self.window = window
+        self.window_transform = dataset.window_transform(window)
+        self.rows, self.starts, self.ends = get_row_spans(
+            geometry,
+            self.window_transform,
+            (int(window.height), int(window.width)),
+        )
+        self.pixels = (self.ends - self.starts).sum()
+        self.packed_masks = {}
+
+    @classmethod
+    def from_spans(cls, dataset, window, rows, starts, ends):
+        """Create from previously created row spans and read window
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+        window : rasterio.windows.Window
+        rows, starts, ends : ndarrays
+            row, start column (inclusive), and end column (exclusive) of each
+            span, sorted by row
+
+        Returns
+        -------
+        SpanGeometryMask
+        """
+        mask = cls.__new__(cls)
+        mask.dataset_transform = dataset.transform
+        mask.window = window
+        mask.window_transform = dataset.window_transform(window)
+        mask.rows = rows
+        mask.starts = starts
+        mask.ends = ends
+        mask.pixels = (ends - starts).sum()
+        mask.packed_masks = {}
+
+        return mask
+
+    def get_shape_mask(self, rows, cols):
+        """Get a dense geometry mask for a subset of the mask window.
+
+        The mask is only created from the row spans the first time it is
+        requested for rows and cols; it is kept bit-packed and unpacked for
+        later requests.
+
+        Parameters
+        ----------
+        rows : slice
+        cols : slice
+
+        Returns
+        -------
+        2d boolean ndarray
+        """
+        key = (rows.start, rows.stop, cols.start, cols.stop)
+        packed = self.packed_masks.get(key)
+        if packed is None:
+            packed = np.packbits(
+                get_span_mask(self.rows, self.starts, self.ends, rows, cols), axis=1
             )
-            if not window_overlaps(read_window, dataset):
-                return False
+            self.packed_masks[key] = packed
 
-        nodata = getattr(np, dataset.dtypes[0])(dataset.nodata)
-        data = dataset.read(1, window=read_window, boundless=True)
+        return np.unpackbits(packed, axis=1, count=cols.stop - cols.start).view(bool)
 
-        # if there are non-nodata values within geometry mask, then there are data
-        if (data[self.shape_mask] != nodata).any():
-            return True
+    def iter_mask_windows(self, dataset):
+        read_window, (rows, cols) = self.get_read_window(dataset)
+        if read_window.width == 0 or read_window.height == 0:
+            return
 
-        return False
+        for row_start, row_end in get_strips(dataset, read_window):
+            # convert to rows within mask window
+            strip_start = rows.start + (row_start - read_window.row_off)
+            strip_end = strip_start + (row_end - row_start)
 
-    def get_pixel_count_by_bin(self, dataset, bins):
-        """Get count of pixels in each bin
+            left, right = np.searchsorted(self.rows, [strip_start, strip_end])
+            if left == right:
+                continue
+
+            # only read columns covered by spans in this strip
+            col_start = max(self.starts[left:right].min(), cols.start)
+            col_end = min(self.ends[left:right].max(), cols.stop)
+            if col_end <= col_start:
+                continue
+
+            yield (
+                Window(
+                    read_window.col_off + (col_start - cols.start),
+                    row_start,
+                    col_end - col_start,
+                    row_end - row_start,
+                ),
+                self.get_shape_mask(
+                    slice(strip_start, strip_end), slice(col_start, col_end)
+                ),
+            )
+
+
+class LabelRaster(GeometryMask):
+    """Raster of labels for many geometries within a window, used to count
+    pixels in each bin for all geometries with a single read of each dataset.
+
+    Only the positions and labels of pixels within geometries are retained.
+    As a geometry mask, this is True for pixels within any of the geometries.
+    """
+
+    def __init__(self, dataset, window, geometries, layers=None):
+        """Rasterize geometries into layers of labels, where pixels within
+        geometries[i] have label i + 1.
+
+        Layers are rasterized one at a time, so memory is limited to a single
+        layer plus the pixels within geometries.
+
+        Parameters
+        ----------
+        dataset : open rasterio dataset
+        window : rasterio.windows.Window
+        geometries : ndarray of shapely geometries
+        layers : ndarray, optional (default: None)
+            layer index for each geometry, e.g., from assign_label_layers;
+            if None, layers are assigned here
+        """
+        self.dataset_transform = dataset.transform
+        self.window = window
+        self.window_transform = dataset.window_transform(window)
+        self.shape = (int(window.height), int(window.width))
+        self.num_labels = len(geometries)
+
+        geometries = np.asarray(geometries)
+        if layers is None:
+            layers = assign_label_layers(geometries)
+
+        out = np.empty(
+            self.shape, dtype="uint16" if self.num_labels < 65535 else "uint32"
+        )
+        rows = []
+        cols = []
+        labels = []
+        for layer in np.unique(layers):
+            ix = np.flatnonzero(layers == layer)
+            out.fill(0)
+            rasterize(
+                zip(geometries[ix], (ix + 1).tolist()),
+                out=out,
+                transform=self.window_transform,
+            )
+            layer_rows, layer_cols = np.nonzero(out)
+            rows.append(layer_rows.astype("int32"))
+            cols.append(layer_cols.astype("int32"))
+            labels.append(out[layer_rows, layer_cols])
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        labels = np.concatenate(labels)
+
+        # sort by row so that the pixels within a range of rows can be found
+        # with a binary search
+        order = np.argsort(rows, kind="stable")
+        self.labels = labels[order]
+        self.rows = rows[order]
+        self.cols = cols[order]
+
+        # number of pixels for each label
+        self.pixels = np.bincount(self.labels, minlength=self.num_labels + 1)[1:]
+
+    def iter_mask_windows(self, dataset):
+        read_window, (rows, cols) = self.get_read_window(dataset)
+        if read_window.width == 0 or read_window.height == 0:
+            return
+
+        mask = np.zeros(self.shape, dtype="bool")
+        mask[self.rows, self.cols] = True
+
+        yield read_window, mask[rows, cols]
+
+    def get_pixel_count_by_label(self, dataset, bins, buffers=None):
+        """Get count of pixels in each bin for each label
+
+        If dataset has multiple bands (e.g., one band per year), all bands are
+        read at once and counts are returned for each band.
 
         Parameters
         ----------
@@ -475,30 +1800,77 @@ class WindowGeometryMask(object):
         bins : list-like
             List-like of values ranging from 0 to max value (not sparse!).
             Counts will be generated that correspond to this list of bins.
+        buffers : ReadBufferPool, optional (default: None)
+            if provided, data are read into a buffer from this pool instead of
+            a newly allocated array
 
         Returns
         -------
         ndarray
-            Total number of pixels for each bin
+            Total number of pixels for each bin, with shape (labels, bins) for
+            single-band datasets or (labels, bands, bins) for multi-band
+            datasets
         """
-        # DEBUG: check for implementation errors
-        # FIXME: comment out
-        if (
-            dataset.transform.a != self.dataset_transform.a
-            or dataset.transform.e != self.dataset_transform.e
-        ):
-            raise ValueError(
-                f"{dataset.name} resolution does not match that used for mask windows"
-            )
-
-        read_window = (
-            self.window
-            if dataset.transform == self.dataset_transform
-            else shift_window(self.window, self.window_transform, dataset.transform)
-        )
         nodata = getattr(np, dataset.dtypes[0])(dataset.nodata)
-        data = dataset.read(1, window=read_window, boundless=True)
-
-        # extract values inside geometry except where they are NODATA
-        values = data[self.shape_mask & (data != nodata)]
-        return np.bincount(values, minlength=len(bins))
+        num_bins = len(bins)
+        # read all bands in a single read
+        indexes = 1 if dataset.count == 1 else None
+
+        counts = np.zeros((self.num_labels + 1, dataset.count, num_bins), dtype="int64")
+
+        read_window, (row_slice, col_slice) = self.get_read_window(dataset)
+
+        # labeled pixels within the read window, relative to read window
+        rows = self.rows - row_slice.start
+        cols = self.cols - col_slice.start
+        height = row_slice.stop - row_slice.start
+        width = col_slice.stop - col_slice.start
+        ix = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        rows = rows[ix]
+        cols = cols[ix]
+        # offset labels by bins, so that all combinations of label and value
+        # can be counted in a single bincount
+        offsets = self.labels[ix].astype("int64") * num_bins
+
+        if len(rows):
+            mask = np.zeros((height, width), dtype="bool")
+            mask[rows, cols] = True
+
+            # only read blocks that contain labeled pixels
+            for window, window_mask in iter_occupied_block_windows(
+                dataset, read_window, mask
+            ):
+                row_start = int(window.row_off - read_window.row_off)
+                col_start = int(window.col_off - read_window.col_off)
+                block_height, block_width = window_mask.shape
+                left, right = np.searchsorted(
+                    rows, [row_start, row_start + block_height]
+                )
+                window_cols = cols[left:right]
+                ix = (window_cols >= col_start) & (
+                    window_cols < col_start + block_width
+                )
+                positions = (rows[left:right][ix] - row_start) * block_width + (
+                    window_cols[ix] - col_start
+                )
+                block_offsets = offsets[left:right][ix]
+
+                with read_into_buffer(dataset, window, indexes, buffers) as data:
+                    if indexes == 1:
+                        data = data[np.newaxis]
+
+                    for band, band_data in enumerate(data):
+                        values = band_data.ravel()[positions]
+                        valid = (values != nodata) & (values < num_bins)
+                        counts[:, band] += np.bincount(
+                            block_offsets[valid] + values[valid],
+                            minlength=counts.shape[0] * num_bins,
+                        ).reshape(-1, num_bins)
+
+        # drop unlabeled pixels
+        counts = counts[1:]
+
+        if dataset.count == 1:
+            return counts[:, 0]
+
+        return counts
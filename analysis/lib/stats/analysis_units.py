@@ -1,27 +1,64 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import product
+import multiprocessing
+
 import geopandas as gp
 import numpy as np
 import pandas as pd
 import shapely
-import rasterio
 
-from analysis.constants import M2_ACRES, SECAS_STATES
-from analysis.lib.geometry import to_dict
-from analysis.lib.raster import WindowGeometryMask, get_window, get_overlapping_windows
+from analysis.constants import M2_ACRES, SECAS_STATES, URBAN_BINS
+from analysis.lib.block_histograms import get_block_histograms
+from analysis.lib.dataset_pool import open_dataset, open_dataset_pool
+from analysis.lib.geometry import cluster_parts
+from analysis.lib.mask_cache import MaskCache
+from analysis.lib.raster import (
+    LabelRaster,
+    ReadBufferPool,
+    SpanGeometryMask,
+    WindowGeometryMask,
+    assign_label_layers,
+    block_geometry_masks,
+    get_overlapping_windows,
+    get_window,
+)
 from analysis.lib.stats.inundation_frequency import (
+    BINS as INUNDATION_FREQUENCY_BINS,
+    inundation_frequency_filename,
     summarize_nlcd_inundation_frequency_in_aoi,
 )
+from analysis.lib.stats.prescreen import get_unavailable_datasets
 from analysis.lib.stats.sarp import extract_sarp_huc12_stats
 from analysis.lib.stats.slr import (
+    SLR_BINS,
+    depth_filename as slr_depth_filename,
     summarize_slr_in_aoi,
     extract_slr_projections_by_geometry,
 )
-from analysis.lib.stats.urban import summarize_urban_in_aoi
+from analysis.lib.stats.urban import summarize_urban_in_aoi, urban_filename
 from analysis.lib.stats.nlcd import (
+    IMPERVIOUS_BINS,
+    LANDCOVER_BINS,
+    impervious_filename,
+    landcover_filename,
     summarize_nlcd_landcover_in_aoi,
     summarize_nlcd_impervious_in_aoi,
 )
-from analysis.lib.stats.se_blueprint_indicators import summarize_indicator_in_aoi
-from api.settings import SHARED_DATA_DIR
+from analysis.lib.stats.se_blueprint_indicators import (
+    get_indicator_bins,
+    get_indicator_filename,
+    summarize_indicator_in_aoi,
+)
+from analysis.lib.window_planner import PLANNER_PARAMS, SPAN_MIN_PIXELS, plan_windows
+from api.settings import (
+    ANALYSIS_PROCESSES,
+    MASK_CACHE_DIR,
+    MASK_CACHE_SIZE,
+    READ_THREADS,
+    SHARED_DATA_DIR,
+)
 
 
 data_dir = SHARED_DATA_DIR / "inputs"
@@ -34,6 +71,26 @@ states_filename = bnd_dir / "states.feather"
 
 WINDOW_SIZE = 2048  # approx 16 MB for 8 bit data
 
+# parts of a geometry farther apart than this many pixels are rasterized and
+# read separately
+CLUSTER_DISTANCE = 2048
+
+# if there are at least BATCH_MIN_UNITS analysis units, those that are at most
+# BATCH_MAX_SIZE pixels wide and high are counted together in batches
+BATCH_MIN_UNITS = 10
+BATCH_MAX_SIZE = WINDOW_SIZE
+# maximum number of label layers for units that overlap each other; each layer
+# is rasterized as a WINDOW_SIZE x WINDOW_SIZE array and may add up to that
+# many labeled pixels
+BATCH_MAX_LAYERS = 8
+
+# cache of rasterized geometry masks, shared by all jobs
+mask_cache = (
+    MaskCache(MASK_CACHE_DIR, max_size=MASK_CACHE_SIZE * 1e6)
+    if MASK_CACHE_SIZE > 0
+    else None
+)
+
 
 class RasterizedGeometry(object):
     """Helper class to detect and extract data for a rasterized geometry
@@ -41,64 +98,279 @@ class RasterizedGeometry(object):
     low resolution mask for detecting datasets (handled prior to calling here)
     """
 
-    def __init__(self, geometry):
+    def __init__(self, geometry, buffers=None, num_rasters=1):
         """_summary_
 
         Parameters
         ----------
         geometry : shapely geometry
+        buffers : ReadBufferPool, optional (default: None)
+            if provided, windows of the extent raster are read into reusable
+            buffers from this pool
+        num_rasters : int, optional (default: 1)
+            number of rasters that will be read using the masks, including the
+            extent raster; used to choose read windows
         """
         self.bounds = shapely.bounds(geometry)
 
-        all_shapes = [to_dict(geometry)]
-
-        # create masks and windows
-        with rasterio.open(extent_filename) as src:
-            windows, ratio = get_overlapping_windows(
-                src, geometry, bounds=self.bounds, window_size=WINDOW_SIZE
-            )
-
-            num_windows = len(windows)
-            self.masks = []
+        # pixel counts by bin, keyed by raster filename
+        self.pixel_counts = {}
+
+        # create masks and windows, or load them from the cache if this
+        # geometry was previously rasterized
+        with open_dataset(extent_filename) as src:
+            cached_masks = None
+            if mask_cache is not None:
+                cache_key = mask_cache.get_key(
+                    geometry,
+                    src,
+                    WINDOW_SIZE,
+                    CLUSTER_DISTANCE,
+                    PLANNER_PARAMS,
+                    num_rasters,
+                )
+                cached_masks = mask_cache.get(cache_key, src)
 
-            # threshold for using windows determined by testing performance
-            if num_windows >= 50 or (num_windows > 1 and ratio <= 0.25):
-                print(f"Using {len(windows)} windows for reading (ratio: {ratio:.3f})")
-                for window in windows:
-                    # clip geometry to window then rasterize
-                    clipped = shapely.clip_by_rect(geometry, *src.window_bounds(window))
-                    mask = WindowGeometryMask(src, window, shapes=[to_dict(clipped)])
-                    self.masks.append(mask)
+            if cached_masks is not None:
+                print(f"Using {len(cached_masks)} cached window(s) for reading")
+                self.masks = cached_masks
 
             else:
-                print(
-                    f"Using 1 window for reading (overlapping windows: {num_windows}, ratio: {ratio:.3f})"
-                )
-                window = get_window(src, self.bounds)
-                mask = WindowGeometryMask(src, window, all_shapes)
-                self.masks.append(mask)
+                self.masks = self.create_masks(src, geometry, num_rasters)
+
+                if mask_cache is not None:
+                    mask_cache.set(cache_key, self.masks)
 
             # cell size in acres
             self.cellsize = src.res[0] * src.res[1] * M2_ACRES
 
-            self.pixels = sum(mask.shape_mask.sum() for mask in self.masks)
-            self.acres = self.pixels * self.cellsize
+            # count pixels in geometry and within extent in a single pass over
+            # the masks
+            self.pixels = 0
+            extent_counts = np.zeros((2,), dtype="int64")
+            histograms = get_block_histograms(extent_filename)
+            for mask in self.masks:
+                self.pixels += mask.pixels
+                extent_counts += mask.get_pixel_count_by_bin(
+                    src, bins=[0, 1], buffers=buffers, histograms=histograms
+                )
+
+            self.pixel_counts[str(extent_filename)] = extent_counts
+
+        self.set_acres()
+
+    @classmethod
+    def from_pixel_counts(cls, cellsize, pixels, pixel_counts):
+        """Create from previously calculated pixel counts, e.g., from
+        get_batch_rasterized_geometries.
+
+        Parameters
+        ----------
+        cellsize : float
+            cell size in acres
+        pixels : int
+            number of pixels in geometry
+        pixel_counts : dict
+            {<filename>: <counts>, ...}; must include counts for the extent
+            raster and all rasters to be summarized
+
+        Returns
+        -------
+        RasterizedGeometry
+        """
+        rasterized_geometry = cls.__new__(cls)
+        rasterized_geometry.masks = []
+        rasterized_geometry.cellsize = cellsize
+        rasterized_geometry.pixels = pixels
+        rasterized_geometry.pixel_counts = pixel_counts
+        rasterized_geometry.set_acres()
+
+        return rasterized_geometry
+
+    def set_acres(self):
+        """Calculate acres in geometry and within the extent from pixel counts"""
+        self.acres = self.pixels * self.cellsize
+
+        self.within_se_pixels = self.pixel_counts[str(extent_filename)][1]
+        self.within_se_acres = self.within_se_pixels * self.cellsize
+
+        self.outside_se_acres = (self.pixels - self.within_se_pixels) * self.cellsize
+
+    def create_masks(self, src, geometry, num_rasters=1):
+        """Rasterize geometry into one or more masks with associated read windows
+
+        Parts of geometry that are far apart are split into separate clusters,
+        each with its own masks and read windows, so that the large empty areas
+        between them are not read.  Clusters do not overlap, so pixels are
+        not counted more than once.
+
+        Parameters
+        ----------
+        src : open rasterio dataset
+            extent dataset
+        geometry : shapely geometry
+        num_rasters : int, optional (default: 1)
+            number of rasters that will be read using the masks
+
+        Returns
+        -------
+        list of WindowGeometryMask or SpanGeometryMask
+        """
+        clusters = cluster_parts(geometry, distance=CLUSTER_DISTANCE * src.res[0])
+        if len(clusters) > 1:
+            print(f"Split geometry into {len(clusters)} clusters of parts")
+
+        masks = []
+        for cluster in clusters:
+            masks.extend(self.create_cluster_masks(src, cluster, num_rasters))
+
+        return masks
+
+    def create_cluster_masks(self, src, geometry, num_rasters=1):
+        """Rasterize a cluster of parts of geometry into one or more masks with
+        associated read windows
+
+        Parameters
+        ----------
+        src : open rasterio dataset
+            extent dataset
+        geometry : shapely geometry
+        num_rasters : int, optional (default: 1)
+            number of rasters that will be read using the masks
+
+        Returns
+        -------
+        list of WindowGeometryMask or SpanGeometryMask
+        """
+        bounds = shapely.bounds(geometry)
+        windows = plan_windows(src, geometry, bounds=bounds, num_rasters=num_rasters)
+        masks = []
 
-            self.within_se_pixels = sum(
-                mask.get_pixel_count_by_bin(src, bins=[0, 1])[1] for mask in self.masks
+        if windows is not None:
+            print(
+                f"Using {len(windows)} windows of {int(windows[0].width)} pixels for reading"
             )
-            self.within_se_acres = self.within_se_pixels * self.cellsize
+            # rasterize all windows together
+            masks = [
+                WindowGeometryMask.from_shape_mask(src, window, shape_mask)
+                for window, shape_mask in zip(
+                    windows, block_geometry_masks(src, windows, geometry)
+                )
+            ]
+
+        else:
+            print("Using 1 window for reading")
+            window = get_window(src, bounds)
+
+            # use a compact mask of row spans for large windows, where a dense
+            # mask would use a lot of memory
+            if window.width * window.height > SPAN_MIN_PIXELS:
+                mask = SpanGeometryMask(src, window, geometry)
+            else:
+                mask = WindowGeometryMask.from_geometry(src, window, geometry)
+
+            masks.append(mask)
+
+        return masks
+
+    def load_pixel_counts(self, rasters, threads=READ_THREADS, buffers=None):
+        """Count pixels in each bin for all rasters in a single pass over the
+        masks.  Each raster is opened once and read once per mask window.
+
+        Counts are retained for use in get_pixel_count_by_bin.
+
+        Parameters
+        ----------
+        rasters : dict
+            {<filename>: <bins>, ...}, where bins are list-like of values
+            ranging from 0 to max value (not sparse!)
+        threads : int, optional (default: READ_THREADS)
+            if greater than 1, each combination of mask window and raster is
+            read and counted in a pool of up to this many threads
+        buffers : ReadBufferPool, optional (default: None)
+            if provided, windows are read into reusable buffers from this pool
+        """
+        rasters = {
+            str(filename): bins
+            for filename, bins in rasters.items()
+            if str(filename) not in self.pixel_counts
+        }
+
+        if not rasters:
+            return
+
+        counts = {filename: [] for filename in rasters}
+        histograms = {filename: get_block_histograms(filename) for filename in rasters}
+
+        tasks = list(product(self.masks, rasters))
+
+        if threads > 1 and len(tasks) > 1:
+            # GDAL releases the GIL while reading and decoding, so reads for
+            # different windows and rasters can run concurrently.  Each thread
+            # uses its own dataset handles.
+            def count_pixels(task):
+                mask, filename = task
+                with open_dataset(filename) as dataset:
+                    return mask.get_pixel_count_by_bin(
+                        dataset,
+                        rasters[filename],
+                        buffers=buffers,
+                        histograms=histograms[filename],
+                    )
+
+            with ThreadPoolExecutor(max_workers=min(threads, len(tasks))) as executor:
+                for (_, filename), task_counts in zip(
+                    tasks, executor.map(count_pixels, tasks)
+                ):
+                    counts[filename].append(task_counts)
+
+        else:
+            with ExitStack() as stack:
+                datasets = {
+                    filename: stack.enter_context(open_dataset(filename))
+                    for filename in rasters
+                }
+
+                for mask, filename in tasks:
+                    counts[filename].append(
+                        mask.get_pixel_count_by_bin(
+                            datasets[filename],
+                            rasters[filename],
+                            buffers=buffers,
+                            histograms=histograms[filename],
+                        )
+                    )
+
+        for filename, raster_counts in counts.items():
+            self.pixel_counts[filename] = np.sum(raster_counts, axis=0)
+
+    def set_empty_pixel_counts(self, rasters):
+        """Set pixel counts to 0 for rasters that are known to not have data
+        within the geometry, so that they are not read.
+
+        Parameters
+        ----------
+        rasters : dict
+            {<filename>: <bins>, ...}
+        """
+        for filename, bins in rasters.items():
+            with open_dataset(filename) as dataset:
+                shape = (
+                    (len(bins),) if dataset.count == 1 else (dataset.count, len(bins))
+                )
 
-            self.outside_se_acres = (
-                self.pixels - self.within_se_pixels
-            ) * self.cellsize
+            self.pixel_counts[str(filename)] = np.zeros(shape, dtype="int64")
 
-    def get_pixel_count_by_bin(self, dataset, bins):
+    def get_pixel_count_by_bin(self, filename, bins):
         """Get count of pixels in each bin
 
+        If counts were not already loaded for the raster using load_pixel_counts,
+        they are read from the raster here.
+
         Parameters
         ----------
-        dataset : open rasterio dataset
+        filename : str or Path
+            raster filename
         bins : list-like
             List-like of values ranging from 0 to max value (not sparse!).
             Counts will be generated that correspond to this list of bins.
@@ -108,16 +380,16 @@ class RasterizedGeometry(object):
         ndarray
             Total number of pixels for each bin
         """
-        return np.sum(
-            [mask.get_pixel_count_by_bin(dataset, bins) for mask in self.masks], axis=0
-        )
+        self.load_pixel_counts({filename: bins})
+        return self.pixel_counts[str(filename)]
 
-    def get_acres_by_bin(self, dataset, bins):
+    def get_acres_by_bin(self, filename, bins):
         """Get acres in each bin
 
         Parameters
         ----------
-        dataset : open rasterio dataset
+        filename : str or Path
+            raster filename
         bins : list-like
             List-like of values ranging from 0 to max value (not sparse!).
             Counts will be generated that correspond to this list of bins.
@@ -127,10 +399,308 @@ class RasterizedGeometry(object):
         ndarray
             Total number of acres for each bin
         """
-        return self.get_pixel_count_by_bin(dataset, bins) * self.cellsize
+        return self.get_pixel_count_by_bin(filename, bins) * self.cellsize
+
+
+def get_dataset_rasters(datasets):
+    """Get the rasters and associated bins that need to be read to calculate
+    statistics for datasets.
+
+    Parameters
+    ----------
+    datasets : list-like
+        list of dataset IDs to query
+
+    Returns
+    -------
+    dict
+        {<filename>: <bins>, ...}
+    """
+    rasters = {}
+
+    if "slr_depth" in datasets or "slr_proj" in datasets:
+        rasters[slr_depth_filename] = SLR_BINS
+
+    if "urban" in datasets:
+        rasters[urban_filename] = URBAN_BINS
+
+    if "nlcd_landcover" in datasets:
+        rasters[landcover_filename] = LANDCOVER_BINS
+
+    if "nlcd_impervious" in datasets:
+        rasters[impervious_filename] = IMPERVIOUS_BINS
+
+    for dataset in datasets:
+        if dataset.startswith("se_blueprint"):
+            rasters[get_indicator_filename(dataset)] = get_indicator_bins(dataset)
+
+    if "nlcd_inundation_freq" in datasets:
+        rasters[inundation_frequency_filename] = INUNDATION_FREQUENCY_BINS
+
+    return rasters
+
 
+def get_batch_units(geometries):
+    """Get the analysis units that are small enough to be counted together in
+    batches using label rasters.  Units must be entirely within the extent
+    raster.
 
-async def get_analysis_unit_results(df, datasets, progress_callback=None):
+    Units that overlap so many other units that they would be assigned to label
+    layer BATCH_MAX_LAYERS or higher are excluded, so that the memory used for
+    each window is limited.  Layers are assigned in order, so geometries must
+    be in the same order as will be passed to get_batch_rasterized_geometries.
+
+    Parameters
+    ----------
+    geometries : ndarray of shapely geometries
+
+    Returns
+    -------
+    ndarray
+        integer indexes of geometries to count in batches
+    """
+    if len(geometries) < BATCH_MIN_UNITS:
+        return np.array([], dtype="int64")
+
+    with open_dataset(extent_filename) as src:
+        res = src.res[0]
+        xmin, ymin, xmax, ymax = src.bounds
+
+    bounds = shapely.bounds(geometries)
+    size = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]) / res
+    within_extent = (
+        (bounds[:, 0] >= xmin)
+        & (bounds[:, 1] >= ymin)
+        & (bounds[:, 2] <= xmax)
+        & (bounds[:, 3] <= ymax)
+    )
+
+    ix = np.flatnonzero((size <= BATCH_MAX_SIZE) & within_extent)
+
+    return ix[assign_label_layers(geometries[ix]) < BATCH_MAX_LAYERS]
+
+
+def get_batch_rasterized_geometries(
+    geometries, datasets, buffers=None, progress_callback=None
+):
+    """Count pixels for many small analysis units at once.
+
+    All analysis units that overlap a window are rasterized into a label raster
+    (with additional layers for units that overlap each other), and pixels in
+    each bin are counted for all labels with a single read of each raster per
+    window.  This scales with the area covered by the analysis units rather
+    than the number of units.
+
+    Parameters
+    ----------
+    geometries : ndarray of shapely geometries
+    datasets : list-like
+        list of dataset IDs to query
+    buffers : ReadBufferPool, optional (default: None)
+        if provided, windows are read into reusable buffers from this pool
+    progress_callback : function, optional (default: None)
+        function to call with the number of analysis units that have been
+        counted, after each window that completes any analysis units
+
+    Returns
+    -------
+    list of RasterizedGeometry
+        one per geometry, with pixel counts loaded for all rasters of datasets
+    """
+    geometries = np.asarray(geometries)
+    num_units = len(geometries)
+    # layers are assigned once for all units so that no window has more layers
+    # than were checked by get_batch_units
+    layers = assign_label_layers(geometries)
+    rasters = {extent_filename: [0, 1], **get_dataset_rasters(datasets)}
+
+    pixels = np.zeros((num_units,), dtype="int64")
+    pixel_counts = {}
+    for filename, bins in rasters.items():
+        with open_dataset(filename) as dataset:
+            shape = (
+                (num_units, len(bins))
+                if dataset.count == 1
+                else (num_units, dataset.count, len(bins))
+            )
+        pixel_counts[str(filename)] = np.zeros(shape, dtype="int64")
+
+    with open_dataset(extent_filename) as src:
+        cellsize = src.res[0] * src.res[1] * M2_ACRES
+
+        windows, _ = get_overlapping_windows(
+            src,
+            shapely.geometrycollections(geometries),
+            bounds=shapely.total_bounds(geometries),
+            window_size=WINDOW_SIZE,
+        )
+        window_boxes = shapely.box(*np.array([src.window_bounds(w) for w in windows]).T)
+
+        window_ix, unit_ix = shapely.STRtree(geometries).query(
+            window_boxes, predicate="intersects"
+        )
+
+        print(
+            f"Counting {num_units} analysis units in batches using {len(np.unique(window_ix))} windows"
+        )
+
+        # number of analysis units that are complete once each window has been
+        # counted; units may overlap several windows and are complete after
+        # the last of these
+        last_window = np.zeros((num_units,), dtype="int64")
+        np.maximum.at(last_window, unit_ix, window_ix)
+        completed = np.cumsum(np.bincount(last_window, minlength=len(windows)))
+        reported = 0
+
+        for i in np.unique(window_ix):
+            units = unit_ix[window_ix == i]
+            label_raster = LabelRaster(
+                src, windows[i], geometries[units], layers=layers[units]
+            )
+            pixels[units] += label_raster.pixels
+
+            for filename, bins in rasters.items():
+                with open_dataset(filename) as dataset:
+                    pixel_counts[str(filename)][units] += (
+                        label_raster.get_pixel_count_by_label(
+                            dataset, bins, buffers=buffers
+                        )
+                    )
+
+            if progress_callback is not None and completed[i] > reported:
+                reported = int(completed[i])
+                progress_callback(reported)
+
+    return [
+        RasterizedGeometry.from_pixel_counts(
+            cellsize,
+            pixels[i],
+            {filename: counts[i] for filename, counts in pixel_counts.items()},
+        )
+        for i in range(num_units)
+    ]
+
+
+def summarize_analysis_unit(geometry, datasets, buffers=None):
+    """Calculate statistics for a single analysis unit
+
+    This is a module-level function so that it can be run in a separate
+    process.
+
+    Parameters
+    ----------
+    geometry : shapely geometry or bytes
+        geometry of analysis unit, or its WKB representation
+    datasets : list-like
+        list of dataset IDs to query
+    buffers : ReadBufferPool, optional (default: None)
+        pool of buffers for reading raster windows; if None, a pool is created
+        for this analysis unit
+
+    Returns
+    -------
+    dict
+    """
+    if isinstance(geometry, bytes):
+        geometry = shapely.from_wkb(geometry)
+
+    if buffers is None:
+        buffers = ReadBufferPool()
+
+    rasters = get_dataset_rasters(datasets)
+
+    # masks are used to read the extent raster and the rasters of datasets
+    rasterized_geometry = RasterizedGeometry(
+        geometry, buffers=buffers, num_rasters=len(rasters) + 1
+    )
+
+    # short-circuit if there are no overlapping pixels
+    if rasterized_geometry.within_se_acres == 0:
+        return summarize_rasterized_geometry(geometry, rasterized_geometry, datasets)
+
+    # skip reading rasters for datasets that the low resolution masks show do
+    # not have data in this analysis unit
+    unavailable_datasets = get_unavailable_datasets(geometry, datasets)
+    if unavailable_datasets:
+        print(f"Skipping datasets without data: {', '.join(unavailable_datasets)}")
+        rasterized_geometry.set_empty_pixel_counts(
+            get_dataset_rasters(unavailable_datasets)
+        )
+
+    # read all rasters in a single pass over the windows of the geometry
+    rasterized_geometry.load_pixel_counts(rasters, buffers=buffers)
+
+    return summarize_rasterized_geometry(geometry, rasterized_geometry, datasets)
+
+
+def summarize_rasterized_geometry(geometry, rasterized_geometry, datasets):
+    """Calculate statistics for a single analysis unit from its rasterized
+    geometry
+
+    Parameters
+    ----------
+    geometry : shapely geometry
+        geometry of analysis unit
+    rasterized_geometry : RasterizedGeometry
+        pixel counts are read from rasters as needed if not already loaded
+    datasets : list-like
+        list of dataset IDs to query
+
+    Returns
+    -------
+    dict
+    """
+    result = {
+        "pixels": rasterized_geometry.pixels,
+        "rasterized_acres": rasterized_geometry.acres,
+        "overlap": rasterized_geometry.within_se_acres,
+        "outside_se": rasterized_geometry.outside_se_acres,
+    }
+
+    # short-circuit if there are no overlapping pixels
+    if rasterized_geometry.within_se_acres == 0:
+        return result
+
+    # Extract SLR
+    if "slr_depth" in datasets or "slr_proj" in datasets:
+        result["slr_depth"] = summarize_slr_in_aoi(rasterized_geometry)
+        # extract_slr_depth_by_mask(mask_config)
+
+    if "slr_proj" in datasets:
+        result["slr_proj"] = extract_slr_projections_by_geometry(geometry)
+
+    # Extract urban
+    if "urban" in datasets:
+        result["urban"] = summarize_urban_in_aoi(rasterized_geometry)
+
+    # Extract NLCD
+    if "nlcd_landcover" in datasets:
+        result["nlcd_landcover"] = summarize_nlcd_landcover_in_aoi(rasterized_geometry)
+
+    if "nlcd_impervious" in datasets:
+        result["nlcd_impervious"] = summarize_nlcd_impervious_in_aoi(
+            rasterized_geometry
+        )
+
+    # Extract SE Blueprint indicators
+    se_blueprint_indicators = [
+        dataset for dataset in datasets if dataset.startswith("se_blueprint")
+    ]
+    for dataset in se_blueprint_indicators:
+        result[dataset] = summarize_indicator_in_aoi(dataset, rasterized_geometry)
+
+    # Extract inundation frequency
+    if "nlcd_inundation_freq" in datasets:
+        result["nlcd_inundation_freq"] = summarize_nlcd_inundation_frequency_in_aoi(
+            rasterized_geometry
+        )
+
+    return result
+
+
+async def get_analysis_unit_results(
+    df, datasets, progress_callback=None, processes=ANALYSIS_PROCESSES
+):
     """Calculate statistics for each analysis unit
 
     Parameters
@@ -141,6 +711,9 @@ async def get_analysis_unit_results(df, datasets, progress_callback=None):
         list of dataset IDs to query
     progress_callback : function, optional (default: None)
         function to call each after each analysis unit is processed
+    processes : int, optional (default: ANALYSIS_PROCESSES)
+        if greater than 1, analysis units are distributed across a pool of up
+        to this many processes
 
     Returns
     -------
@@ -168,8 +741,6 @@ async def get_analysis_unit_results(df, datasets, progress_callback=None):
     df["acres"] = shapely.area(df.geometry.values) * M2_ACRES
     df["bounds"] = shapely.bounds(df.geometry.values).tolist()
 
-    results = []
-
     sarp_huc12_stats = None
     if (
         len(
@@ -179,73 +750,108 @@ async def get_analysis_unit_results(df, datasets, progress_callback=None):
         )
         > 0
     ):
-        sarp_huc12_stats = extract_sarp_huc12_stats(df)
-
-    count = 0
-
-    for index, row in df.iterrows():
-        print(f"Processing {index}")
-        rasterized_geometry = RasterizedGeometry(row.geometry)
-
-        result = {
-            "pixels": rasterized_geometry.pixels,
-            "rasterized_acres": rasterized_geometry.acres,
-            "overlap": rasterized_geometry.within_se_acres,
-            "outside_se": rasterized_geometry.outside_se_acres,
-        }
-
-        # short-circuit if there are no overlapping pixels
-        if rasterized_geometry.within_se_acres == 0:
-            results.append(result)
-
-            if progress_callback is not None:
-                await progress_callback(100 * count / len(df))
-
-            count += 1
-            continue
+        sarp_huc12_stats = await asyncio.to_thread(extract_sarp_huc12_stats, df)
+
+    results = [None] * len(df)
+    geometries = df.geometry.values
+
+    # buffers for reading raster windows are reused across analysis units
+    # and released once all have been processed
+    buffers = ReadBufferPool()
+
+    # process analysis units in Hilbert order of their bounds so that
+    # consecutive units read nearby blocks of each raster, which are more
+    # likely to be cached; results are stored in index order
+    order = np.argsort(df.geometry.hilbert_distance().values, kind="stable")
+
+    # count small analysis units together in batches, reading each raster
+    # window once for all units within it
+    batch_ix = order[get_batch_units(geometries[order])]
+    if len(batch_ix):
+        loop = asyncio.get_running_loop()
+
+        def batch_progress_callback(count):
+            # called from the thread below; wait for progress to be recorded
+            # by the event loop so that updates are recorded in order
+            asyncio.run_coroutine_threadsafe(
+                progress_callback(100 * count / len(df)), loop
+            ).result()
+
+        def summarize_batch():
+            rasterized_geometries = get_batch_rasterized_geometries(
+                geometries[batch_ix],
+                datasets,
+                buffers=buffers,
+                progress_callback=(
+                    batch_progress_callback if progress_callback is not None else None
+                ),
+            )
+            for i, rasterized_geometry in zip(batch_ix, rasterized_geometries):
+                results[i] = summarize_rasterized_geometry(
+                    geometries[i], rasterized_geometry, datasets
+                )
 
-        # Extract SLR
-        if "slr_depth" in datasets or "slr_proj" in datasets:
-            result["slr_depth"] = summarize_slr_in_aoi(rasterized_geometry)
-            # extract_slr_depth_by_mask(mask_config)
+        # run in a thread so that the event loop is not blocked
+        await asyncio.to_thread(summarize_batch)
 
-        if "slr_proj" in datasets:
-            result["slr_proj"] = extract_slr_projections_by_geometry(row.geometry)
+    # remaining analysis units are processed individually
+    remaining_ix = order[~np.isin(order, batch_ix)]
 
-        # Extract urban
-        if "urban" in datasets:
-            result["urban"] = summarize_urban_in_aoi(rasterized_geometry)
+    if processes > 1 and len(remaining_ix) > 1:
+        loop = asyncio.get_running_loop()
 
-        # Extract NLCD
-        if "nlcd_landcover" in datasets:
-            result["nlcd_landcover"] = summarize_nlcd_landcover_in_aoi(
-                rasterized_geometry
-            )
+        executor = ProcessPoolExecutor(
+            max_workers=min(processes, len(remaining_ix)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=open_dataset_pool,
+        )
 
-        if "nlcd_impervious" in datasets:
-            result["nlcd_impervious"] = summarize_nlcd_impervious_in_aoi(
-                rasterized_geometry
+        async def summarize(i, wkb):
+            return i, await loop.run_in_executor(
+                executor, summarize_analysis_unit, wkb, datasets
             )
 
-        # Extract SE Blueprint indicators
-        se_blueprint_indicators = [
-            dataset for dataset in datasets if dataset.startswith("se_blueprint")
+        tasks = [
+            asyncio.ensure_future(summarize(i, wkb))
+            for i, wkb in zip(remaining_ix, shapely.to_wkb(geometries[remaining_ix]))
         ]
-        for dataset in se_blueprint_indicators:
-            result[dataset] = summarize_indicator_in_aoi(dataset, rasterized_geometry)
 
-        # Extract inundation frequency
-        if "nlcd_inundation_freq" in datasets:
-            result["nlcd_inundation_freq"] = summarize_nlcd_inundation_frequency_in_aoi(
-                rasterized_geometry
+        try:
+            # results are returned in order of completion; store in index order
+            for count, task in enumerate(
+                asyncio.as_completed(tasks), start=len(batch_ix) + 1
+            ):
+                i, result = await task
+                results[i] = result
+
+                if progress_callback is not None:
+                    await progress_callback(100 * count / len(df))
+
+        except (asyncio.CancelledError, Exception):
+            # job was cancelled (e.g., timed out) or an analysis unit failed;
+            # cancel the remaining analysis units instead of waiting for them
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        finally:
+            # do not block the event loop waiting for running analysis units
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    else:
+        for count, i in enumerate(remaining_ix, start=len(batch_ix) + 1):
+            print(f"Processing {df.index[i]}")
+            # run in a thread so that the event loop is not blocked
+            results[i] = await asyncio.to_thread(
+                summarize_analysis_unit, geometries[i], datasets, buffers
             )
 
-        results.append(result)
-
-        if progress_callback is not None:
-            await progress_callback(100 * count / len(df))
+            if progress_callback is not None:
+                await progress_callback(100 * count / len(df))
 
-        count += 1
+    buffers.clear()
 
     df = df[["states", "count", "acres"]].join(pd.DataFrame(results, index=df.index))
 
@@ -1,7 +1,5 @@
 from collections import defaultdict
 
-import rasterio
-
 from analysis.constants import NLCD_INUNDATION_FREQUENCY, NLCD_INDEXES
 from api.settings import DATA_DIR
 
@@ -32,8 +30,9 @@ def summarize_nlcd_inundation_frequency_in_aoi(rasterized_geometry):
         {<NLCD index>: [<inundation freq bin 0 acres>,...], ...}
     """
 
-    with rasterio.open(inundation_frequency_filename) as src:
-        acres = rasterized_geometry.get_acres_by_bin(src, BINS).round(2)
+    acres = rasterized_geometry.get_acres_by_bin(
+        inundation_frequency_filename, BINS
+    ).round(2)
 
     results = defaultdict(list)
     for key, entry in NLCD_INUNDATION_FREQUENCY.items():
@@ -1,15 +1,22 @@
 import numpy as np
-import rasterio
 
-from analysis.constants import NLCD_YEARS, NLCD_INDEXES
+from analysis.constants import NLCD_INDEXES
 from api.settings import SHARED_DATA_DIR
 
 src_dir = SHARED_DATA_DIR / "inputs/nlcd"
-landcover_filename = str(src_dir / "landcover_{year}.tif")
-impervious_filename = str(src_dir / "impervious_{year}.tif")
+# single-band rasters for each year, used to build the multi-band stacks
+landcover_year_filename = str(src_dir / "landcover_{year}.tif")
+impervious_year_filename = str(src_dir / "impervious_{year}.tif")
+
+# multi-band rasters with one band per year in NLCD_YEARS
+landcover_filename = src_dir / "landcover_stack.tif"
+impervious_filename = src_dir / "impervious_stack.tif"
 
 PERCENTS = np.arange(0, 1.01, 0.01)
 
+LANDCOVER_BINS = list(NLCD_INDEXES.keys())
+IMPERVIOUS_BINS = PERCENTS.tolist()
+
 
 def summarize_nlcd_landcover_in_aoi(rasterized_geometry):
     """Calculate the area of overlap between shapes and NLCD indexes (not codes)
@@ -27,17 +34,11 @@ def summarize_nlcd_landcover_in_aoi(rasterized_geometry):
         {<NLCD index>: [<acres 2020>, <acres 2030>, ..., <acres 2100>], ...}
     """
 
-    bins = list(NLCD_INDEXES.keys())
-    areas = []
-
-    for year in NLCD_YEARS:
-        with rasterio.open(landcover_filename.format(year=year)) as src:
-            acres = rasterized_geometry.get_acres_by_bin(src, bins)
-
-        areas.append(acres)
+    # acres by year (band) and bin
+    acres = rasterized_geometry.get_acres_by_bin(landcover_filename, LANDCOVER_BINS)
 
     # Transpose and convert to dict, only keep those that have areas
-    areas = np.array(areas).T
+    areas = acres.T
 
     results = {
         NLCD_INDEXES[i]["label"]: areas[i].tolist()
@@ -64,14 +65,7 @@ def summarize_nlcd_impervious_in_aoi(rasterized_geometry):
         [<acres 2020>, <acres 2030>, ..., <acres 2100>]
     """
 
-    bins = PERCENTS.tolist()
-    areas = []
-
-    for year in NLCD_YEARS:
-        with rasterio.open(impervious_filename.format(year=year)) as src:
-            acres = rasterized_geometry.get_acres_by_bin(src, bins)
-
-        areas.append((PERCENTS * acres).sum())
+    # acres by year (band) and bin
+    acres = rasterized_geometry.get_acres_by_bin(impervious_filename, IMPERVIOUS_BINS)
 
-    # Transpose
-    return np.array(areas).T.tolist()
+    return (PERCENTS * acres).sum(axis=1).tolist()
@@ -2,7 +2,7 @@ import geopandas as gp
 import shapely
 
 from analysis.constants import DATASETS
-from analysis.lib.raster import detect_data
+from analysis.lib.raster import detect_data, detect_data_from_availability
 from analysis.lib.geometry import to_dict_all
 from analysis.lib.stats.slr import src_dir as slr_dir
 from analysis.lib.stats.nlcd import src_dir as nlcd_dir
@@ -14,6 +14,9 @@ from api.settings import SHARED_DATA_DIR
 
 data_dir = SHARED_DATA_DIR / "inputs"
 boundary_filename = data_dir / "boundaries/se_boundary.feather"
+# bit-packed availability of all raster datasets, created by
+# analysis/prep/prep_availability_raster.py
+availability_filename = data_dir / "boundaries/dataset_availability.tif"
 
 
 indicators = [d for d in DATASETS.values() if d["id"].startswith("se_")]
@@ -33,6 +36,42 @@ raster_datasets = {
 }
 
 
+def detect_available_datasets(ids, shapes, bounds):
+    """Detect which raster datasets have data within shapes based on their low
+    resolution masks.
+
+    If present, the dataset availability raster is used to check all datasets
+    with a single read; any datasets not included in it or whose masks were
+    modified after it was created are checked against their individual masks.
+
+    Parameters
+    ----------
+    ids : list-like
+        list of raster dataset IDs to check
+    shapes : list-like of GeoJSON features or shapely geometries
+    bounds : list-like of [xmin, ymin, xmax, ymax]
+
+    Returns
+    -------
+    dict
+        {<id>: True if there are data pixels present in shapes, otherwise False}
+    """
+    available_datasets = {}
+    if availability_filename.exists():
+        available_datasets = detect_data_from_availability(
+            availability_filename,
+            {id: raster_datasets[id] for id in ids},
+            shapes,
+            bounds,
+        )
+
+    remaining = {id: raster_datasets[id] for id in ids if id not in available_datasets}
+    if remaining:
+        available_datasets.update(detect_data(remaining, shapes, bounds))
+
+    return {id: available_datasets.get(id, False) for id in ids}
+
+
 def get_overlapping_analysis_units(df):
     """Return analysis units that intersect the Southeast boundary
 
@@ -55,8 +94,8 @@ def get_overlapping_analysis_units(df):
 def get_available_datasets(df):
     shapes = to_dict_all(df.geometry.values)
 
-    available_datasets = detect_data(
-        raster_datasets,
+    available_datasets = detect_available_datasets(
+        list(raster_datasets.keys()),
         shapes,
         df.total_bounds,
     )
@@ -69,3 +108,36 @@ def get_available_datasets(df):
     available_datasets["sarp_aquatic_network_alteration"] = True
 
     return available_datasets
+
+
+def get_unavailable_datasets(geometry, datasets):
+    """Get the raster datasets that have no data within geometry based on their
+    low resolution masks, so that their full resolution data need not be read.
+
+    Parameters
+    ----------
+    geometry : shapely geometry
+    datasets : list-like
+        list of dataset IDs to check
+
+    Returns
+    -------
+    list
+        IDs of datasets that do not have data within geometry
+    """
+    ids = [id for id in raster_datasets if id in datasets]
+
+    # SLR projections require SLR depth
+    if "slr_proj" in datasets and "slr_depth" not in ids:
+        ids.append("slr_depth")
+
+    if not ids:
+        return []
+
+    # shapely geometries are passed directly to rasterization, which is faster
+    # than converting them to GeoJSON first
+    available_datasets = detect_available_datasets(
+        ids, [geometry], shapely.bounds(geometry)
+    )
+
+    return [id for id in ids if not available_datasets.get(id, False)]
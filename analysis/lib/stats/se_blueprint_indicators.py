@@ -1,5 +1,4 @@
 import numpy as np
-import rasterio
 
 from analysis.constants import DATASETS
 from api.settings import SHARED_DATA_DIR
@@ -7,6 +6,38 @@ from api.settings import SHARED_DATA_DIR
 src_dir = SHARED_DATA_DIR / "inputs/indicators"
 
 
+def get_indicator_filename(id):
+    """Get the filename of the indicator dataset
+
+    Parameters
+    ----------
+    id : str
+        ID of indicator dataset
+
+    Returns
+    -------
+    Path
+    """
+    return src_dir / DATASETS[id]["filename"]
+
+
+def get_indicator_bins(id):
+    """Get the bins used to count pixels in the indicator dataset, ranging from 0
+    to the max value of the indicator.
+
+    Parameters
+    ----------
+    id : str
+        ID of indicator dataset
+
+    Returns
+    -------
+    ndarray
+    """
+    values = [e["value"] for e in DATASETS[id]["values"]]
+    return np.arange(0, max(values) + 1)
+
+
 def summarize_indicator_in_aoi(id, rasterized_geometry):
     """Calculate the area of overlap by value in the indicator dataset
 
@@ -28,10 +59,10 @@ def summarize_indicator_in_aoi(id, rasterized_geometry):
     indicator = DATASETS[id]
 
     values = [e["value"] for e in indicator["values"]]
-    bins = np.arange(0, max(values) + 1)
 
-    with rasterio.open(src_dir / indicator["filename"]) as src:
-        acres = rasterized_geometry.get_acres_by_bin(src, bins)
+    acres = rasterized_geometry.get_acres_by_bin(
+        get_indicator_filename(id), get_indicator_bins(id)
+    )
 
     # Some indicators exclude 0 values, remove them from results
     min_value = min(values)
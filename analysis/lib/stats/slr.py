@@ -1,6 +1,5 @@
 import geopandas as gp
 import numpy as np
-import rasterio
 import shapely
 
 from analysis.constants import (
@@ -40,8 +39,7 @@ def summarize_slr_in_aoi(rasterized_geometry):
         [area for 0ft inundation, area for 1ft, ..., area for 10f]
     """
 
-    with rasterio.open(depth_filename) as src:
-        acres = rasterized_geometry.get_acres_by_bin(src, bins=SLR_BINS)
+    acres = rasterized_geometry.get_acres_by_bin(depth_filename, bins=SLR_BINS)
 
     nodata_acres = (
         rasterized_geometry.acres - rasterized_geometry.outside_se_acres - acres.sum()
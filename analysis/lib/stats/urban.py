@@ -1,5 +1,3 @@
-import rasterio
-
 from analysis.constants import (
     URBAN_YEARS,
     URBAN_PROBABILITIES,
@@ -9,7 +7,11 @@ from analysis.constants import (
 from api.settings import SHARED_DATA_DIR
 
 src_dir = SHARED_DATA_DIR / "inputs/threats/urban"
-urban_filename = str(src_dir / "urban_{year}.tif")
+# single-band rasters for each year, used to build the multi-band stack
+urban_year_filename = str(src_dir / "urban_{year}.tif")
+
+# multi-band raster with one band per year in URBAN_YEARS
+urban_filename = src_dir / "urban_stack.tif"
 
 
 def summarize_urban_in_aoi(rasterized_geometry):
@@ -35,10 +37,10 @@ def summarize_urban_in_aoi(rasterized_geometry):
     high = []
     low = []
 
-    for year in URBAN_YEARS:
-        with rasterio.open(urban_filename.format(year=year)) as src:
-            acres = rasterized_geometry.get_acres_by_bin(src, URBAN_BINS)
+    # acres by year (band) and bin
+    acres_by_year = rasterized_geometry.get_acres_by_bin(urban_filename, URBAN_BINS)
 
+    for year, acres in zip(URBAN_YEARS, acres_by_year):
         if year == 2030:
             # extract area already urban (in index 51) and add to front of list
             already_urban = acres[51]
@@ -0,0 +1,133 @@
+import logging
+
+from analysis.lib.raster import get_overlapping_windows, get_window
+
+
+log = logging.getLogger(__name__)
+
+# candidate window sizes, as multiples of the internal block size of the dataset
+# so that windows are aligned to block boundaries
+WINDOW_BLOCKS = (2, 4, 8, 16)
+
+# single windows with more pixels than this use compact row span masks
+# (SpanGeometryMask) instead of dense masks
+SPAN_MIN_PIXELS = 2048 * 2048
+
+# costs used to compare strategies, in nanoseconds, measured for 30 m rasters
+# with LZW-compressed internal blocks of 256 x 256 pixels.  Decoding is not
+# included because the same internal blocks of each raster are decoded for
+# every strategy.  Masks are created once and then used to read each raster.
+# cost per pixel to create dense masks, and to scan them while reading a raster
+DENSE_CREATE_COST = 1.2
+DENSE_READ_COST = 0.2
+# cost per pixel to create the dense strips of row span masks on first read,
+# and to unpack them while reading a raster
+SPAN_CREATE_COST = 0.5
+SPAN_READ_COST = 0.1
+# cost per window to create its mask, and to read it from a raster
+WINDOW_CREATE_COST = 330_000
+WINDOW_READ_COST = 250_000
+
+# values that affect the plan, used to invalidate cached masks when changed
+PLANNER_PARAMS = (
+    WINDOW_BLOCKS,
+    SPAN_MIN_PIXELS,
+    DENSE_CREATE_COST,
+    DENSE_READ_COST,
+    SPAN_CREATE_COST,
+    SPAN_READ_COST,
+    WINDOW_CREATE_COST,
+    WINDOW_READ_COST,
+)
+
+
+def estimate_cost(mask_pixels, num_windows, num_rasters, span=False):
+    """Estimate cost of creating masks and reading rasters using a strategy.
+
+    Parameters
+    ----------
+    mask_pixels : int
+        number of pixels in the geometry masks
+    num_windows : int
+    num_rasters : int
+        number of rasters read using the masks
+    span : bool, optional (default: False)
+        if True, masks are row span masks instead of dense masks
+
+    Returns
+    -------
+    float
+    """
+    if span:
+        create_cost, read_cost = SPAN_CREATE_COST, SPAN_READ_COST
+    else:
+        create_cost, read_cost = DENSE_CREATE_COST, DENSE_READ_COST
+
+    return (
+        create_cost * mask_pixels
+        + WINDOW_CREATE_COST * num_windows
+        + num_rasters * (read_cost * mask_pixels + WINDOW_READ_COST * num_windows)
+    )
+
+
+def plan_windows(src, geometry, bounds, num_rasters=1):
+    """Choose between reading geometry in a single window covering its bounds
+    or in windows of one of several sizes aligned to the internal blocks of src,
+    based on the estimated cost of each strategy.
+
+    Only the internal blocks that contain pixels within the geometry masks are
+    decoded regardless of strategy, so the choice depends on the area and type
+    of the geometry masks, the number of windows, and the number of rasters
+    read using them.  A single window uses a row span mask if it has more than
+    SPAN_MIN_PIXELS pixels.  Estimates for each strategy are logged so that
+    the costs can be calibrated.
+
+    Parameters
+    ----------
+    src : open rasterio dataset
+    geometry : shapely geometry
+    bounds : [xmin, ymin, xmax, ymax]
+        Bounds of geometry
+    num_rasters : int, optional (default: 1)
+        number of rasters that will be read using the windows
+
+    Returns
+    -------
+    list of rasterio.windows.Window or None
+        windows that overlap geometry, or None if geometry should be read in a
+        single window
+    """
+    block_height, block_width = src.block_shapes[0]
+    block_size = max(block_height, block_width)
+    sizes = [block_size * factor for factor in WINDOW_BLOCKS]
+
+    candidates = {
+        size: get_overlapping_windows(src, geometry, bounds, size)[0] for size in sizes
+    }
+
+    window = get_window(src, bounds)
+    window_pixels = window.width * window.height
+    estimates = {
+        "single": estimate_cost(
+            window_pixels, 1, num_rasters, span=window_pixels > SPAN_MIN_PIXELS
+        )
+    }
+    for size, windows in candidates.items():
+        # a single window is never worse than one aligned window
+        if len(windows) > 1:
+            estimates[size] = estimate_cost(
+                len(windows) * size * size, len(windows), num_rasters
+            )
+
+    plan = min(estimates, key=estimates.get)
+
+    log.info(
+        f"window plan: {plan} for {num_rasters} rasters "
+        f"(windows: { {size: len(windows) for size, windows in candidates.items()} }, "
+        f"estimates: { {k: f'{v:.3g}' for k, v in estimates.items()} })"
+    )
+
+    if plan == "single":
+        return None
+
+    return candidates[plan]
@@ -0,0 +1,13 @@
+from analysis.lib.raster import create_availability_raster
+from analysis.lib.stats.prescreen import availability_filename, raster_datasets
+
+
+### Combine the low resolution masks of all raster datasets into a single raster
+# where each bit indicates if one dataset has data, so that all datasets can be
+# prescreened with a single read
+# NOTE: this should be recreated whenever the low resolution masks are updated;
+# datasets with masks modified after it was created are not read from it
+
+
+print("Creating dataset availability raster")
+create_availability_raster(raster_datasets, availability_filename)
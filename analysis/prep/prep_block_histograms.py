@@ -0,0 +1,20 @@
+from analysis.lib.block_histograms import create_block_histograms
+from analysis.lib.stats.analysis_units import extent_filename, get_dataset_rasters
+from analysis.lib.stats.prescreen import raster_datasets
+
+
+### Create histograms of values within each internal block of categorical rasters
+# these are used to count pixels in blocks that are entirely within an analysis
+# unit without reading those blocks
+# NOTE: these must be recreated whenever the rasters are updated; out of date
+# histograms are ignored
+
+
+rasters = {
+    extent_filename: [0, 1],
+    **get_dataset_rasters(list(raster_datasets.keys())),
+}
+
+for filename, bins in rasters.items():
+    print(f"Creating block histograms for {filename}")
+    create_block_histograms(filename, len(bins))
@@ -0,0 +1,20 @@
+from analysis.lib.hot_store import create_hot_store
+from analysis.lib.stats.analysis_units import extent_filename
+from analysis.lib.stats.nlcd import impervious_filename, landcover_filename
+from analysis.lib.stats.urban import urban_filename
+
+
+### Create uncompressed, memory-mapped copies of the rasters used in nearly
+# every report, so that they can be read without decompression
+# NOTE: these are ignored if the rasters are modified after they are created;
+# they must be recreated after updating the rasters
+
+
+for filename in [
+    extent_filename,
+    landcover_filename,
+    impervious_filename,
+    urban_filename,
+]:
+    print(f"Creating hot store for {filename}")
+    create_hot_store(filename)
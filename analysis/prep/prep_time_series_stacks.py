@@ -0,0 +1,36 @@
+from analysis.constants import NLCD_YEARS, URBAN_YEARS
+from analysis.lib.raster import write_band_stack
+from analysis.lib.stats.nlcd import (
+    impervious_filename,
+    impervious_year_filename,
+    landcover_filename,
+    landcover_year_filename,
+)
+from analysis.lib.stats.urban import urban_filename, urban_year_filename
+
+
+### Combine single-band rasters for each year into multi-band stacks
+# these are read with a single windowed read for all years when calculating
+# statistics
+
+
+print("Creating NLCD land cover stack")
+write_band_stack(
+    [landcover_year_filename.format(year=year) for year in NLCD_YEARS],
+    landcover_filename,
+    descriptions=NLCD_YEARS,
+)
+
+print("Creating NLCD impervious surface stack")
+write_band_stack(
+    [impervious_year_filename.format(year=year) for year in NLCD_YEARS],
+    impervious_filename,
+    descriptions=NLCD_YEARS,
+)
+
+print("Creating urbanization stack")
+write_band_stack(
+    [urban_year_filename.format(year=year) for year in URBAN_YEARS],
+    urban_filename,
+    descriptions=URBAN_YEARS,
+)
@@ -19,6 +19,14 @@ ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 API_TOKEN = os.getenv("API_TOKEN")
 API_SECRET = os.getenv("API_SECRET")
 MAX_JOBS = int(os.getenv("MAX_JOBS", 2))
+# number of processes used to calculate statistics for analysis units within a
+# job; 1 processes all analysis units in the worker process
+ANALYSIS_PROCESSES = int(os.getenv("ANALYSIS_PROCESSES", 1))
+# number of threads used to read raster windows for an analysis unit
+READ_THREADS = int(os.getenv("READ_THREADS", 1))
+# maximum size of cache of rasterized geometry masks in TEMP_DIR; 0 disables it
+MASK_CACHE_SIZE = float(os.getenv("MASK_CACHE_SIZE", 1024))  # MB
+MASK_CACHE_DIR = TEMP_DIR / "mask_cache"
 MAX_FILE_SIZE = float(os.getenv("MAX_FILE_SIZE", 100))  # MB
 # individual extents
 CUSTOM_REPORT_MAX_EXTENT_ACRES = int(
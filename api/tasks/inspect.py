@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from zipfile import ZipFile
 
@@ -92,7 +93,7 @@ def get_dataset(zip_filename):
         raise DataError("data source must contain only one data layer")
 
     if "Polygon" not in layers[0, 1]:
-        log.error(f"Upload data source is not a polygon: {layers[0,1]}")
+        log.error(f"Upload data source is not a polygon: {layers[0, 1]}")
         raise DataError("data source must be a Polygon type")
 
     return filename, layers[0, 0]
@@ -101,13 +102,16 @@ def get_dataset(zip_filename):
 async def inspect(ctx, zip_filename, uuid):
     await set_progress(ctx["redis"], ctx["job_id"], 0, "Inspecting data files")
 
+    # NOTE: reading and geometry operations are run via asyncio.to_thread to avoid
+    # stalling other jobs in this worker
+
     ### get dataset and layer, and validate that only one polygon layer is present
-    dataset, layer = get_dataset(zip_filename)
+    dataset, layer = await asyncio.to_thread(get_dataset, zip_filename)
     path = f"zip://{zip_filename}/{dataset}"
 
     log.info(f"detected dataset: {path}, layer={layer}")
 
-    info = read_info(path, layer=layer)
+    info = await asyncio.to_thread(read_info, path, layer=layer)
 
     # pass along uuid from task context
     results = {
@@ -125,7 +129,7 @@ async def inspect(ctx, zip_filename, uuid):
     ]
 
     try:
-        df = read_dataframe(path, layer=layer, columns=columns)
+        df = await asyncio.to_thread(read_dataframe, path, layer=layer, columns=columns)
     except Exception as ex:
         log.error(f"Failed to read dataframe: {path}, layer={layer}")
         log.error(ex)
@@ -147,7 +151,7 @@ async def inspect(ctx, zip_filename, uuid):
         ctx["redis"], ctx["job_id"], 5, "Reprojecting to standard projection"
     )
     try:
-        df = df.to_crs(DATA_CRS)
+        df = await asyncio.to_thread(df.to_crs, DATA_CRS)
     except Exception:
         log.error(f"Failed to reproject dataframe: {path}, layer={layer}")
         raise DataError("Could not reproject dataset to standard projection")
@@ -179,7 +183,7 @@ async def inspect(ctx, zip_filename, uuid):
     await set_progress(ctx["redis"], ctx["job_id"], 10, "Making valid")
     # make valid and only keep polygon parts
     try:
-        df["geometry"] = make_valid(df.geometry.values)
+        df["geometry"] = await asyncio.to_thread(make_valid, df.geometry.values)
         df = df.explode(index_parts=False)
         df = df.loc[
             shapely.get_type_id(df.geometry.values) == 3, keep_cols
@@ -192,18 +196,20 @@ async def inspect(ctx, zip_filename, uuid):
     if len(df) == 0:
         raise DataError("No valid polygon boundaries available in dataset")
 
-    overlapping_df = get_overlapping_analysis_units(df)
+    overlapping_df = await asyncio.to_thread(get_overlapping_analysis_units, df)
 
     if len(overlapping_df) == 0:
         raise DataError("None of the polygon boundaries overlap available datasets")
 
     # Save as feather file for subsequent steps
     outfilename = str(zip_filename).replace(".zip", ".feather")
-    df.to_feather(outfilename)
+    await asyncio.to_thread(df.to_feather, outfilename)
 
     ### prescreen datasets available (using only analysis units that overlap)
     await set_progress(ctx["redis"], ctx["job_id"], 50, "Checking available datasets")
-    results["available_datasets"] = get_available_datasets(overlapping_df)
+    results["available_datasets"] = await asyncio.to_thread(
+        get_available_datasets, overlapping_df
+    )
 
     await set_progress(ctx["redis"], ctx["job_id"], 100, "All done!")
 
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import math
 import tempfile
@@ -41,7 +42,11 @@ async def create_report(ctx, uuid, datasets, field=None, name=None):
         raise ValueError("Dataset does not exist")
 
     columns = [field] if field else []
-    df = gp.read_feather(filename, columns=["geometry"] + columns)
+    # blocking and CPU-bound operations are run in a thread so that the worker
+    # event loop remains responsive to other jobs and progress updates
+    df = await asyncio.to_thread(
+        gp.read_feather, filename, columns=["geometry"] + columns
+    )
 
     if not field:
         field = "__analysis_unit"
@@ -51,7 +56,7 @@ async def create_report(ctx, uuid, datasets, field=None, name=None):
         await set_progress(ctx["redis"], ctx["job_id"], 5, "Merging boundaries")
 
         try:
-            df = dissolve(df, by=field).set_index(field)
+            df = (await asyncio.to_thread(dissolve, df, by=field)).set_index(field)
 
         except Exception as ex:
             log.error(f"Failed to dissolve dataframe: {filename} on field: {field}")
@@ -84,7 +89,7 @@ async def create_report(ctx, uuid, datasets, field=None, name=None):
     await set_progress(
         ctx["redis"], ctx["job_id"], progress_scale[1], "Creating XLSX file"
     )
-    xlsx = create_xlsx(results, datasets)
+    xlsx = await asyncio.to_thread(create_xlsx, results, datasets)
 
     await set_progress(ctx["redis"], ctx["job_id"], 95, "Nearly done")
 
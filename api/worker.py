@@ -5,10 +5,12 @@ import arq
 from arq import cron
 import sentry_sdk
 
+from analysis.lib.dataset_pool import open_dataset_pool, close_dataset_pool
 from api.tasks.inspect import inspect
 from api.tasks.report import create_report
 from api.settings import (
     TEMP_DIR,
+    MASK_CACHE_DIR,
     JOB_TIMEOUT,
     FILE_RETENTION,
     SENTRY_DSN,
@@ -37,6 +39,11 @@ async def cleanup_files(ctx):
     ctx : arq ctx (unused)
     """
     for path in TEMP_DIR.rglob("*"):
+        # skip subdirectories and the mask cache, which removes its own least
+        # recently used entries
+        if MASK_CACHE_DIR in path.parents or not path.is_file():
+            continue
+
         if path.stat().st_mtime < time() - FILE_RETENTION:
             path.unlink()
 
@@ -44,9 +51,13 @@ async def cleanup_files(ctx):
 async def startup(ctx):
     ctx["redis"] = await arq.create_pool(REDIS)
 
+    # keep raster datasets open for reuse across analysis units and jobs
+    open_dataset_pool()
+
 
 async def shutdown(ctx):
     await ctx["redis"].close()
+    close_dataset_pool()
 
 
 class WorkerSettings:
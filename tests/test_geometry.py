@@ -0,0 +1,30 @@
+import numpy as np
+import shapely
+
+from analysis.lib.geometry import to_dict, to_dict_all
+
+
+def test_to_dict_all_matches_to_dict():
+    polygon = shapely.Point(0, 0).buffer(10)
+    hole = shapely.Point(0, 0).buffer(5)
+    polygons = [
+        polygon,
+        polygon.difference(hole),
+        shapely.box(20, 20, 30, 30),
+        shapely.Polygon(),
+    ]
+    multipolygons = [
+        shapely.MultiPolygon([polygon.difference(hole), shapely.box(20, 20, 30, 30)]),
+        shapely.MultiPolygon([shapely.box(0, 0, 1, 1)]),
+        shapely.MultiPolygon(),
+    ]
+
+    # Polygons only, MultiPolygons only, and a mix of both
+    for geometries in [polygons, multipolygons, polygons + multipolygons]:
+        geometries = np.array(geometries)
+        expected = [to_dict(geometry) for geometry in geometries]
+        assert to_dict_all(geometries).tolist() == expected
+
+    out = to_dict_all(np.array([], dtype="object"))
+    assert out.dtype == object
+    assert len(out) == 0
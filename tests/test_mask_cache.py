@@ -0,0 +1,72 @@
+from affine import Affine
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+import shapely
+
+from analysis.lib import mask_cache
+from analysis.lib.mask_cache import MaskCache
+from analysis.lib.raster import SpanGeometryMask, WindowGeometryMask
+
+
+def create_dataset(memfile):
+    with memfile.open(
+        driver="GTiff",
+        width=100,
+        height=100,
+        count=1,
+        dtype="uint8",
+        transform=Affine(30, 0, 0, 0, -30, 3000),
+    ) as out:
+        out.write(np.ones((100, 100), dtype="uint8"), 1)
+
+    return memfile.open()
+
+
+def test_mask_cache_preserves_kind_of_empty_span_mask(tmp_path):
+    cache = MaskCache(tmp_path, max_size=1e6)
+
+    with MemoryFile() as memfile, create_dataset(memfile) as src:
+        window = Window(10, 10, 20, 20)
+        empty = np.array([], dtype="int64")
+        masks = [
+            SpanGeometryMask.from_spans(src, window, empty, empty, empty),
+            WindowGeometryMask.from_shape_mask(
+                src, window, np.zeros((20, 20), dtype="bool")
+            ),
+            SpanGeometryMask(src, window, shapely.box(400, 2400, 700, 2700)),
+        ]
+        cache.set("key", masks)
+
+        cached = cache.get("key", src)
+
+    assert [type(mask) for mask in cached] == [type(mask) for mask in masks]
+    assert [mask.pixels for mask in cached] == [mask.pixels for mask in masks]
+
+
+def test_mask_cache_scans_only_when_needed(tmp_path, monkeypatch):
+    monkeypatch.setattr(mask_cache, "EVICT_INTERVAL", 5)
+    cache = MaskCache(tmp_path, max_size=1e6)
+
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+
+    with MemoryFile() as memfile, create_dataset(memfile) as src:
+        mask = WindowGeometryMask.from_shape_mask(
+            src, Window(0, 0, 100, 100), np.ones((100, 100), dtype="bool")
+        )
+
+        # first write scans the cache, then every EVICT_INTERVAL writes
+        for i in range(11):
+            cache.set(f"key{i}", [mask])
+
+        assert len(scans) == 3
+
+        # estimated size over max_size triggers a scan and eviction
+        cache.max_size = cache.size
+        cache.set("key11", [mask])
+
+    assert len(scans) == 4
+    assert len(list(tmp_path.glob("*.npz"))) == 11
+    assert cache.size <= cache.max_size
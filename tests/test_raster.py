@@ -0,0 +1,409 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from affine import Affine
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+import shapely
+
+from analysis.lib import block_histograms, raster
+from analysis.lib.block_histograms import (
+    BlockHistograms,
+    create_block_histograms,
+    get_block_histogram_filenames,
+)
+from analysis.lib.raster import (
+    LabelRaster,
+    ReadBufferPool,
+    SpanGeometryMask,
+    assign_label_layers,
+    block_geometry_masks,
+    get_row_spans,
+    get_span_mask,
+)
+
+
+def create_dataset(memfile, data, transform, nodata=255):
+    with memfile.open(
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=1,
+        dtype=data.dtype,
+        transform=transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+    ) as out:
+        out.write(data, 1)
+
+    return memfile.open()
+
+
+def get_tie_geometries(transform):
+    """Geometries with edges and vertices exactly on pixel centers, in both
+    ring orientations"""
+
+    def box(col_start, row_start, col_end, row_end):
+        return shapely.box(
+            *(transform * (col_start, row_end)), *(transform * (col_end, row_start))
+        )
+
+    outer = box(10.5, 10.5, 80.5, 60.5)
+    hole = box(30.5, 20.5, 50.5, 40.5)
+    # staircase of boxes that share edges on pixel centers
+    steps = shapely.union_all(
+        [
+            box(100.5 + 10 * i, 20.5 + 10 * i, 120.5 + 10 * i, 40.5 + 10 * i)
+            for i in range(5)
+        ]
+    )
+    diamond = shapely.Polygon(
+        [
+            transform * xy
+            for xy in [(300.5, 20.5), (340.5, 60.5), (300.5, 100.5), (260.5, 60.5)]
+        ]
+    )
+    geometries = [
+        outer,
+        outer.difference(hole),
+        steps,
+        diamond,
+        shapely.MultiPolygon([outer, box(200.5, 10.5, 240.5, 30.5)]),
+    ]
+
+    return geometries + [shapely.reverse(geometry) for geometry in geometries]
+
+
+def test_read_buffer_pool_reuses_buffers_across_shapes():
+    buffers = ReadBufferPool()
+
+    with buffers.get((2, 256, 512), "uint8") as out:
+        assert out.shape == (2, 256, 512)
+        assert out.dtype == np.uint8
+        out[:] = 1
+
+    # smaller windows of different shapes are views of the same buffer
+    for shape in [(100, 37), (256, 256), (3, 17, 300), (1, 1)]:
+        with buffers.get(shape, "uint8") as out:
+            assert out.shape == shape
+            out[:] = 2
+
+    assert len(buffers.buffers[np.dtype("uint8").str]) == 1
+    assert buffers.nbytes == 2 * 256 * 512
+
+    # buffer grows to fit a larger window
+    with buffers.get((1024, 1024), "uint8") as out:
+        assert out.shape == (1024, 1024)
+
+    assert len(buffers.buffers[np.dtype("uint8").str]) == 1
+    assert buffers.nbytes == 1024 * 1024
+
+    # data types are kept separate
+    with buffers.get((10, 10), "uint16") as out:
+        assert out.dtype == np.uint16
+
+    assert buffers.nbytes == 1024 * 1024 + 200
+
+    buffers.clear()
+    assert buffers.nbytes == 0
+
+
+def test_read_buffer_pool_limited_to_concurrent_reads():
+    buffers = ReadBufferPool()
+    rng = np.random.default_rng(0)
+    shapes = [tuple(shape) for shape in rng.integers(1, 512, (200, 2))]
+
+    def read(shape):
+        with buffers.get(shape, "uint8") as out:
+            out[:] = shape[0] % 256
+            return (out == shape[0] % 256).all()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(read, shapes))
+
+    assert len(buffers.buffers[np.dtype("uint8").str]) <= 4
+    assert buffers.nbytes <= 4 * 511 * 511
+
+
+def test_label_raster_matches_geometry_masks():
+    transform = Affine(30, 0, 0, 0, -30, 30 * 1000)
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 5, (1000, 1000), dtype="uint8")
+    data[:10] = 255
+
+    # nested, overlapping, and touching geometries, with edges on pixel centers
+    geometries = np.array(
+        [shapely.Point(15000, 15000).buffer(30 * r) for r in range(20, 120, 10)]
+        + [
+            shapely.box(30 * 100.5, 30 * 100.5, 30 * 200.5, 30 * 200.5),
+            shapely.box(30 * 200.5, 30 * 100.5, 30 * 300.5, 30 * 200.5),
+            shapely.box(30 * 400, 30 * 900, 30 * 1100, 30 * 1100),
+        ]
+    )
+    layers = assign_label_layers(geometries)
+    assert layers[:10].tolist() == list(range(10))
+    assert layers[-3] != layers[-2]
+
+    with MemoryFile() as memfile, create_dataset(memfile, data, transform) as src:
+        window = Window(0, 0, 1000, 1000)
+        label_raster = LabelRaster(src, window, geometries)
+        assert label_raster.labels.dtype == np.uint16
+
+        counts = label_raster.get_pixel_count_by_label(src, bins=range(5))
+
+        for i, geometry in enumerate(geometries):
+            mask = ~geometry_mask([geometry], out_shape=data.shape, transform=transform)
+            assert label_raster.pixels[i] == mask.sum()
+
+            values = data[mask]
+            expected = np.bincount(values[values != 255], minlength=5)[:5]
+            assert (counts[i] == expected).all()
+
+
+def test_row_spans_match_geometry_mask_on_pixel_centers():
+    transform = Affine(30, 0, 1000015, 0, -30, 1500045)
+    shape = (120, 400)
+
+    for geometry in get_tie_geometries(transform):
+        expected = ~geometry_mask([geometry], out_shape=shape, transform=transform)
+
+        rows, starts, ends = get_row_spans(geometry, transform, shape)
+        mask = get_span_mask(rows, starts, ends, slice(0, shape[0]), slice(0, shape[1]))
+
+        assert (mask == expected).all()
+        # spans do not overlap
+        assert (ends - starts).sum() == expected.sum()
+
+
+def test_span_mask_from_assigned_or_decoded_spans(monkeypatch):
+    transform = Affine(30, 0, 1000015, 0, -30, 1500045)
+    geometry = get_tie_geometries(transform)[1]
+    rows, starts, ends = get_row_spans(geometry, transform, (120, 400))
+    expected = ~geometry_mask([geometry], out_shape=(120, 400), transform=transform)
+
+    row_slice = slice(15, 50)
+    col_slice = slice(25, 70)
+    for min_pixels in [1, 1 << 30]:
+        monkeypatch.setattr(raster, "SPAN_ASSIGN_MIN_PIXELS", min_pixels)
+
+        mask = get_span_mask(rows, starts, ends, row_slice, col_slice)
+        assert (mask == expected[row_slice, col_slice]).all()
+
+        # pixels outside spans are not changed
+        out = np.zeros((120, 400), dtype="bool")
+        out[row_slice, 40] = True
+        get_span_mask(
+            rows, starts, ends, row_slice, col_slice, out=out[row_slice, col_slice]
+        )
+        expected_out = np.zeros_like(expected)
+        expected_out[row_slice, col_slice] = expected[row_slice, col_slice]
+        expected_out[row_slice, 40] = True
+        assert (out == expected_out).all()
+
+
+def test_block_geometry_masks_match_geometry_mask_on_pixel_centers():
+    transform = Affine(30, 0, 1000015, 0, -30, 1500045)
+    data = np.zeros((1000, 1000), dtype="uint8")
+
+    with MemoryFile() as memfile, create_dataset(memfile, data, transform) as src:
+        # windows that are and are not aligned to blocks
+        windows = [
+            Window(0, 0, 512, 512),
+            Window(-20, -10, 300, 200),
+            Window(100, 17, 300, 100),
+        ]
+
+        for geometry in get_tie_geometries(transform):
+            masks = block_geometry_masks(src, windows, geometry)
+
+            for window, mask in zip(windows, masks):
+                expected = ~geometry_mask(
+                    [geometry],
+                    out_shape=(window.height, window.width),
+                    transform=src.window_transform(window),
+                )
+                assert (mask == expected).all()
+
+            span_mask = SpanGeometryMask(src, windows[0], geometry)
+            assert span_mask.pixels == masks[0].sum()
+
+
+def test_span_mask_strips_created_once(monkeypatch):
+    transform = Affine(30, 0, 0, 0, -30, 30 * 1000)
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 5, (1000, 1000), dtype="uint8")
+    geometry = shapely.MultiPolygon(
+        [
+            shapely.Point(transform * (300, 300)).buffer(30 * 200),
+            shapely.Point(transform * (700, 650)).buffer(30 * 250),
+        ]
+    )
+    expected_mask = ~geometry_mask(
+        [geometry], out_shape=data.shape, transform=transform
+    )
+    expected = np.bincount(data[expected_mask], minlength=5)
+
+    calls = []
+    get_span_mask = raster.get_span_mask
+
+    def count_calls(*args, **kwargs):
+        calls.append(args[3])
+        return get_span_mask(*args, **kwargs)
+
+    monkeypatch.setattr(raster, "get_span_mask", count_calls)
+
+    with MemoryFile() as memfile, create_dataset(memfile, data, transform) as src:
+        mask = SpanGeometryMask(src, Window(0, 0, 1000, 1000), geometry)
+        for _ in range(3):
+            assert (mask.get_pixel_count_by_bin(src, bins=range(5)) == expected).all()
+
+    # one mask per strip, created on first read
+    assert len(calls) == len(mask.packed_masks) == 4
+
+
+def test_block_geometry_masks_inside_and_outside_windows():
+    transform = Affine(30, 0, 1000015, 0, -30, 1500045)
+    data = np.zeros((1024, 1024), dtype="uint8")
+    geometry = shapely.Point(transform * (400, 400)).buffer(30 * 390)
+
+    with MemoryFile() as memfile, create_dataset(memfile, data, transform) as src:
+        windows = [
+            Window(256, 256, 256, 256),
+            Window(768, 768, 256, 256),
+            Window(0, 0, 768, 768),
+        ]
+        inside, outside, boundary = block_geometry_masks(src, windows, geometry)
+
+        # windows entirely inside or outside geometry are not allocated
+        assert inside.all() and not inside.flags.writeable
+        assert not outside.any() and not outside.flags.writeable
+
+        expected = ~geometry_mask(
+            [geometry], out_shape=(768, 768), transform=src.window_transform(windows[2])
+        )
+        assert (boundary == expected).all()
+
+
+def test_count_full_blocks_matches_geometry_mask(tmp_path, monkeypatch):
+    # use small blocks and groups of blocks to keep the test fast
+    BLOCK_SIZE = 32
+    PYRAMID_FACTOR = 4
+    monkeypatch.setattr(block_histograms, "BLOCK_SIZE", BLOCK_SIZE)
+    monkeypatch.setattr(block_histograms, "PYRAMID_FACTOR", PYRAMID_FACTOR)
+
+    transform = Affine(30, 0, 0, 0, -30, 30 * 1000)
+    rng = np.random.default_rng(1)
+    # more than 2 groups of blocks along each dimension, with partial blocks
+    shape = (
+        2 * PYRAMID_FACTOR * BLOCK_SIZE + 30,
+        2 * PYRAMID_FACTOR * BLOCK_SIZE + 15,
+    )
+    # values >= num_bins and NODATA are not counted
+    data = rng.integers(0, 10, (2, *shape), dtype="uint8")
+    data[1, :50] = 255
+
+    filename = tmp_path / "test.tif"
+    with rasterio.open(
+        filename,
+        "w",
+        driver="GTiff",
+        width=shape[1],
+        height=shape[0],
+        count=2,
+        dtype="uint8",
+        transform=transform,
+        nodata=255,
+        tiled=True,
+        blockxsize=BLOCK_SIZE,
+        blockysize=BLOCK_SIZE,
+    ) as out:
+        out.write(data)
+
+    num_bins = 8
+    create_block_histograms(filename, num_bins)
+    histograms = BlockHistograms(*get_block_histogram_filenames(filename))
+    assert histograms.blocks.shape[2:] == (2, num_bins)
+
+    center = transform * (shape[1] / 2, shape[0] / 2)
+    geometries = [
+        shapely.Point(*center).buffer(30 * 100),
+        shapely.Point(*center)
+        .buffer(30 * 120)
+        .difference(shapely.Point(*center).buffer(30 * 20)),
+        shapely.box(*transform * (0, shape[0]), *transform * (shape[1], 0)),
+    ]
+
+    # windows aligned and not aligned to blocks and groups of blocks
+    windows = [
+        Window(0, 0, shape[1], shape[0]),
+        Window(1, 3, shape[1] - 1, shape[0] - 3),
+        Window(BLOCK_SIZE, 0, shape[1] - BLOCK_SIZE, shape[0]),
+        Window(BLOCK_SIZE * 3, BLOCK_SIZE, BLOCK_SIZE * 5, BLOCK_SIZE * 7),
+    ]
+    for _ in range(50):
+        row_off, col_off = rng.integers(0, 150, 2)
+        height = rng.integers(1, shape[0] - row_off)
+        width = rng.integers(1, shape[1] - col_off)
+        windows.append(Window(col_off, row_off, width, height))
+
+    # record which pyramid levels are used
+    used = set()
+
+    class Recorder:
+        def __init__(self, name, values):
+            self.name = name
+            self.values = values
+
+        def __getitem__(self, key):
+            used.add(self.name)
+            return self.values[key]
+
+        @property
+        def shape(self):
+            return self.values.shape
+
+    histograms.blocks = Recorder("blocks", histograms.blocks)
+    histograms.groups = Recorder("groups", histograms.groups)
+
+    for geometry in geometries:
+        for window in windows:
+            window_data = data[
+                :,
+                window.row_off : window.row_off + window.height,
+                window.col_off : window.col_off + window.width,
+            ]
+            mask = ~geometry_mask(
+                [geometry],
+                out_shape=(window.height, window.width),
+                transform=rasterio.windows.transform(window, transform),
+            )
+
+            for bins in [num_bins, 5]:
+                counts, remaining = histograms.count_full_blocks(window, mask, bins)
+
+                # only pixels within the mask are removed, in whole blocks
+                # aligned to the dataset
+                removed = mask & ~remaining
+                assert not (remaining & ~mask).any()
+                row_blocks = (np.arange(window.height) + window.row_off) // BLOCK_SIZE
+                col_blocks = (np.arange(window.width) + window.col_off) // BLOCK_SIZE
+                block_ids = row_blocks[:, np.newaxis] * 1000 + col_blocks
+                removed_blocks = np.unique(block_ids[removed])
+                assert (np.isin(block_ids, removed_blocks) == removed).all()
+                assert removed.sum() == len(removed_blocks) * BLOCK_SIZE * BLOCK_SIZE
+
+                for band in range(2):
+                    values = window_data[band]
+                    expected = np.bincount(
+                        values[mask & (values < bins)], minlength=bins
+                    )
+                    remaining_counts = np.bincount(
+                        values[remaining & (values < bins)], minlength=bins
+                    )
+                    assert (counts[band] + remaining_counts == expected).all()
+
+    assert used == {"blocks", "groups"}